@@ -0,0 +1,181 @@
+"""Local stand-ins for the ActiveCampaign, Stripe and SendGrid APIs
+
+Every fake answers the requests the app makes with canned responses after
+a configurable delay and counts the calls per endpoint.
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+import itertools
+import json
+import re
+import threading
+import time
+
+
+class FakeServer(object):
+    """HTTP server in a background thread answering with routes
+
+    Args:
+      routes: list of (method, path regex, handler), the handler gets the
+        match and the parsed json body and returns (status, json body)
+      latency: seconds every response is delayed
+    """
+
+    def __init__(self, routes, latency: float = 0):
+        self.routes = [(m, re.compile(p), h) for m, p, h in routes]
+        self.latency = latency
+        self.calls = {}
+        self._lock = threading.Lock()
+
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # answer without waiting for delayed ACKs of the client
+            disable_nagle_algorithm = True
+
+            def _handle(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                raw = self.rfile.read(length) if length else b''
+                path = urlparse(self.path).path
+                status, body = fake.dispatch(self.command, path, raw)
+                data = json.dumps(body).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            do_GET = do_POST = do_PUT = do_DELETE = _handle
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.url = 'http://127.0.0.1:{}'.format(self.server.server_port)
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+
+    def reset(self):
+        with self._lock:
+            self.calls = {}
+
+    def total_calls(self):
+        with self._lock:
+            return sum(self.calls.values())
+
+    def dispatch(self, method, path, raw):
+        if self.latency:
+            time.sleep(self.latency)
+        try:
+            body = json.loads(raw) if raw and raw[:1] in (b'{', b'[') else {}
+        except ValueError:
+            body = {}
+        for m, pattern, handler in self.routes:
+            match = pattern.fullmatch(path)
+            if m == method and match:
+                with self._lock:
+                    key = '{} {}'.format(method, pattern.pattern)
+                    self.calls[key] = self.calls.get(key, 0) + 1
+                return handler(match, body)
+        return 404, {'error': 'no fake route for {} {}'.format(method, path)}
+
+
+def fake_ac(latency: float = 0, deals: int = 50):
+    """Fake ActiveCampaign api v3 below /api/3/
+
+    Args:
+      latency: seconds every response is delayed
+      deals: open deals returned by deal searches, the last one carries
+        the Reservationsnummer used by the demo views
+    """
+    ids = itertools.count(1000)
+
+    def listing(key, objects):
+        return lambda match, body: (200, {key: objects, 'meta': {'total': str(len(objects))}})
+
+    def deal_search(match, body):
+        data = [{'custom_field_id': 3, 'custom_field_number_value': str(318000.0 + i),
+                 'deal_id': str(i)} for i in range(deals - 1)]
+        data.append({'custom_field_id': 3, 'custom_field_number_value': '318482.0',
+                     'deal_id': str(deals)})
+        return 200, {'deals': [{'id': str(i + 1)} for i in range(deals)],
+                     'dealCustomFieldData': data, 'meta': {'total': str(deals)}}
+
+    routes = [
+        ('GET', '/api/3/fields', listing('fields', [{'id': '1', 'title': 'Sprache'}])),
+        ('GET', '/api/3/dealCustomFieldMeta', listing('dealCustomFieldMeta', [
+            {'id': '1', 'fieldLabel': 'Anreise'}, {'id': '2', 'fieldLabel': 'Abreise'},
+            {'id': '3', 'fieldLabel': 'Reservationsnummer'}])),
+        ('GET', '/api/3/tags', listing('tags', [{'id': '1', 'tag': 'Wellness'}])),
+        ('GET', '/api/3/lists', listing('lists', [{'id': '1', 'name': 'Marketing'}])),
+        ('POST', '/api/3/contact/sync', lambda match, body: (
+            200, {'contact': dict(body.get('contact', {}), id='358')})),
+        ('POST', '/api/3/contactTags', lambda match, body: (201, body)),
+        ('POST', '/api/3/contactLists', lambda match, body: (200, body)),
+        ('POST', '/api/3/import/bulk_import', lambda match, body: (
+            200, {'success': 1, 'queued_contacts': len(body.get('contacts', []))})),
+        ('GET', '/api/3/deals', deal_search),
+        ('POST', '/api/3/deals', lambda match, body: (
+            201, {'deal': dict(body.get('deal', {}), id=str(next(ids)))})),
+        ('PUT', r'/api/3/deals/(\w+)', lambda match, body: (
+            200, {'deal': dict(body.get('deal', {}), id=match.group(1))})),
+    ]
+    return FakeServer(routes, latency)
+
+
+def checkout_session(session_id='cs_test_1'):
+    """a completed checkout session as sent in webhooks"""
+    return {
+        'id': session_id,
+        'object': 'checkout.session',
+        'currency': 'chf',
+        'amount_total': 24000,
+        'payment_intent': 'pi_test_1',
+        'customer_details': {'email': 'guest@example.com'},
+    }
+
+
+def fake_stripe(latency: float = 0):
+    """Fake Stripe api below /v1/"""
+
+    def retrieve_session(match, body):
+        session = checkout_session(match.group(1))
+        session['line_items'] = {'object': 'list', 'has_more': False, 'data': [{
+            'id': 'li_test_1', 'object': 'item', 'currency': 'chf', 'amount_total': 24000,
+            'quantity': 1, 'description': 'Doppelzimmer Classic',
+            'price': {'id': 'price_test_1', 'object': 'price', 'product': {
+                'id': 'prod_test_1', 'object': 'product',
+                'metadata': {'prod_id': 'gutscheinSA01'}}},
+        }]}
+        session['payment_intent'] = {'id': 'pi_test_1', 'object': 'payment_intent', 'charges': {
+            'object': 'list', 'data': [{
+                'id': 'ch_test_1', 'object': 'charge',
+                'payment_method_details': {'card': {'brand': 'visa', 'last4': '4242'}},
+                'billing_details': {'name': 'Guest', 'email': 'guest@example.com'},
+            }]}}
+        return 200, session
+
+    routes = [
+        ('POST', '/v1/checkout/sessions', lambda match, body: (
+            200, {'id': 'cs_test_1', 'object': 'checkout.session'})),
+        ('GET', r'/v1/checkout/sessions/(\w+)', retrieve_session),
+        ('GET', r'/v1/products/(\w+)', lambda match, body: (200, {
+            'id': match.group(1), 'object': 'product', 'metadata': {'prod_id': 'gutscheinSA01'}})),
+    ]
+    return FakeServer(routes, latency)
+
+
+def fake_sendgrid(latency: float = 0):
+    """Fake SendGrid api below /v3/"""
+    routes = [
+        ('POST', '/v3/mail/send', lambda match, body: (202, {})),
+    ]
+    return FakeServer(routes, latency)
@@ -0,0 +1,85 @@
+"""Start up time of the app with different blueprints enabled
+
+Every measurement runs in a fresh interpreter: it imports the project,
+calls create_app() and reports the time taken and which of the heavy SDKs
+got imported. The SDKs should only show up once they are used.
+
+Run from the flask directory:
+
+    python -m benchmarks.import_time --runs 10
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+sdks = ['requests', 'stripe', 'sendgrid', 'aiohttp']
+
+_measure = """
+import json, sys, time
+start = time.perf_counter()
+try:
+    import config
+except ImportError:
+    import config_public as config
+    sys.modules['config'] = config
+from project import create_app
+app = create_app(blueprints={blueprints!r})
+elapsed = time.perf_counter() - start
+# lazily imported modules are in sys.modules before they are executed
+loaded = [m for m in {sdks!r} if type(sys.modules.get(m)).__name__ == 'module']
+print(json.dumps({{'seconds': elapsed, 'sdks': loaded}}))
+"""
+
+_sdk_import = """
+import json, time
+start = time.perf_counter()
+import {sdk}
+print(json.dumps({{'seconds': time.perf_counter() - start, 'sdks': [{sdk!r}]}}))
+"""
+
+scenarios = [
+    ('all blueprints', ['frontend', 'payment']),
+    ('frontend only', ['frontend']),
+    ('payment only', ['payment']),
+    ('no blueprints (CLI)', []),
+]
+
+
+def _run(code, env):
+    output = subprocess.run([sys.executable, '-c', code], env=env, check=True,
+                            stdout=subprocess.PIPE, universal_newlines=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def _report(name, code, runs, env):
+    results = [_run(code, env) for i in range(runs)]
+    times = sorted(r['seconds'] * 1000 for r in results)
+    print('{:<24} {:>8.1f} {:>8.1f} {:>8.1f}   {}'.format(
+        name, times[0], statistics.median(times), times[-1],
+        ', '.join(results[-1]['sdks']) or '-'))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--runs', type=int, default=5, help='interpreters per scenario')
+    args = parser.parse_args(argv)
+
+    env = dict(os.environ)
+    env.setdefault('DATA_DIR', tempfile.mkdtemp(prefix='bench-'))
+    env['PYTHONDONTWRITEBYTECODE'] = '1'
+    # compile once, the measured runs use the cached bytecode
+    _run(_measure.format(blueprints=None, sdks=sdks), dict(env, PYTHONDONTWRITEBYTECODE=''))
+
+    print('{:<24} {:>8} {:>8} {:>8}   {}'.format('', 'min ms', 'p50 ms', 'max ms', 'SDKs loaded'))
+    for name, blueprints in scenarios:
+        _report(name, _measure.format(blueprints=blueprints, sdks=sdks), args.runs, env)
+    for sdk in sdks:
+        _report('import {}'.format(sdk), _sdk_import.format(sdk=sdk), args.runs, env)
+
+
+if __name__ == '__main__':
+    main()
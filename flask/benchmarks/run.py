@@ -0,0 +1,196 @@
+"""Load benchmark of the app's flows against local fake upstream services
+
+Starts fake AC, Stripe and SendGrid servers, points the app at them and
+drives every flow with concurrent requests. Reports throughput, p50/p99
+latency and the upstream calls made per request.
+
+Run from the flask directory:
+
+    python -m benchmarks.run --requests 200 --concurrency 8 --latency 0.05
+"""
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import hashlib
+import hmac
+import itertools
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+from benchmarks.fakes import checkout_session, fake_ac, fake_sendgrid, fake_stripe
+
+
+def _configure(args, ac, stripe_fake, sendgrid):
+    """points the config at the fakes, must run before the app is imported"""
+    os.environ.setdefault('DATA_DIR', tempfile.mkdtemp(prefix='bench-'))
+    try:
+        import config
+    except ImportError:
+        # no private config, use the public template
+        import config_public as config
+        sys.modules['config'] = config
+
+    config.Config.AC_URL = ac.url + '/api/3/'
+    config.Config.AC_KEY = 'bench'
+    config.Config.AC_RATE_LIMIT = args.ac_rate_limit
+    config.Config.AC_RATE_BURST = args.ac_rate_limit
+    config.Config.SENDGRID_HOST = sendgrid.url
+    config.Config.SENDGRID_API_KEY = 'SG.bench'
+    config.Config.STRIPE_SECRET_KEY = 'sk_test_bench'
+    config.Config.STRIPE_WEBHOOK_SECRET = 'whsec_bench'
+    if args.order_mail_template:
+        config.Config.ORDER_MAIL_TEMPLATE = args.order_mail_template
+    return config.Config
+
+
+def _signed_event(secret: str, event_id: str):
+    """a checkout.session.completed event with a valid Stripe-Signature"""
+    payload = json.dumps({
+        'id': event_id,
+        'object': 'event',
+        'type': 'checkout.session.completed',
+        'data': {'object': checkout_session()},
+    })
+    timestamp = int(time.time())
+    signature = hmac.new(secret.encode('utf-8'),
+                         '{}.{}'.format(timestamp, payload).encode('utf-8'),
+                         hashlib.sha256).hexdigest()
+    return payload, 't={},v1={}'.format(timestamp, signature)
+
+
+def _percentile(values, p):
+    values = sorted(values)
+    if not values:
+        return 0
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def _run_flow(name, call, requests, concurrency, fakes):
+    """calls call(i) requests times using concurrency threads
+
+    Returns: dict with the measured numbers of the flow
+    """
+    for fake in fakes.values():
+        fake.reset()
+
+    def timed_call(i):
+        start = time.perf_counter()
+        ok = call(i)
+        return time.perf_counter() - start, ok
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(timed_call, range(requests)))
+    elapsed = time.perf_counter() - start
+
+    latencies = [r[0] for r in results]
+    upstream = {k: f.total_calls() / requests for k, f in fakes.items()}
+    return {
+        'flow': name,
+        'requests': requests,
+        'errors': sum(1 for r in results if not r[1]),
+        'throughput': requests / elapsed,
+        'p50': _percentile(latencies, 50) * 1000,
+        'p99': _percentile(latencies, 99) * 1000,
+        'upstream': upstream,
+    }
+
+
+def _report(results):
+    header = '{:<16} {:>8} {:>7} {:>10} {:>9} {:>9} {:>7} {:>7} {:>9}'.format(
+        'flow', 'requests', 'errors', 'req/s', 'p50 ms', 'p99 ms', 'ac', 'stripe', 'sendgrid')
+    print(header)
+    print('-' * len(header))
+    for r in results:
+        print('{:<16} {:>8} {:>7} {:>10.1f} {:>9.1f} {:>9.1f} {:>7.2f} {:>7.2f} {:>9.2f}'.format(
+            r['flow'], r['requests'], r['errors'], r['throughput'], r['p50'], r['p99'],
+            r['upstream']['ac'], r['upstream']['stripe'], r['upstream']['sendgrid']))
+    print('(ac, stripe, sendgrid: upstream calls per request)')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=100, help='requests per flow')
+    parser.add_argument('--concurrency', type=int, default=8, help='concurrent clients')
+    parser.add_argument('--latency', type=float, default=0.02,
+                        help='seconds every fake upstream response is delayed')
+    parser.add_argument('--deals', type=int, default=50, help='deals returned by deal searches')
+    parser.add_argument('--warmup', type=int, default=1, help='untimed requests per flow')
+    parser.add_argument('--ac-rate-limit', type=float, default=1000,
+                        help='AC requests per second, the real quota is a few per second')
+    parser.add_argument('--order-mail-template',
+                        help='send customer and internal confirmation in one request')
+    parser.add_argument('--flows', nargs='*', help='run only these flows')
+    args = parser.parse_args(argv)
+
+    fakes = {
+        'ac': fake_ac(args.latency, args.deals).start(),
+        'stripe': fake_stripe(args.latency).start(),
+        'sendgrid': fake_sendgrid(args.latency).start(),
+    }
+    config = _configure(args, fakes['ac'], fakes['stripe'], fakes['sendgrid'])
+
+    import stripe
+    stripe.api_base = fakes['stripe'].url
+
+    from project import create_app
+    from project import jobs
+
+    app = create_app()
+    local = threading.local()
+
+    def client():
+        if not hasattr(local, 'client'):
+            local.client = app.test_client()
+        return local.client
+
+    def get(path):
+        return lambda i: client().get(path).status_code < 400
+
+    event_ids = itertools.count()
+
+    def webhook(i):
+        payload, signature = _signed_event(config.STRIPE_WEBHOOK_SECRET,
+                                           'evt_bench_{}'.format(next(event_ids)))
+        response = client().post('/payment/stripe_webhook', data=payload,
+                                 content_type='application/json',
+                                 headers={'Stripe-Signature': signature})
+        return response.status_code == 200
+
+    def fulfillment(i):
+        with app.app_context():
+            return jobs.work_one(app.logger)
+
+    flows = [
+        ('create_contact', get('/create_contact')),
+        ('create_deal', get('/create_deal')),
+        ('update_deal', get('/update_deal')),
+        ('stripe_pay', get('/payment/stripe_pay?id=gutscheinSA01')),
+        ('products', get('/payment/products')),
+        ('stripe_webhook', webhook),
+        # processes the jobs queued by the webhook flow
+        ('fulfillment', fulfillment),
+    ]
+    if args.flows:
+        flows = [f for f in flows if f[0] in args.flows]
+
+    results = []
+    try:
+        for name, call in flows:
+            warmup = 0 if name == 'fulfillment' else args.warmup
+            for i in range(warmup):
+                call(i)
+            requests = args.requests + (args.warmup if name == 'fulfillment' else 0)
+            results.append(_run_flow(name, call, requests, args.concurrency, fakes))
+    finally:
+        for fake in fakes.values():
+            fake.stop()
+
+    _report(results)
+
+
+if __name__ == '__main__':
+    main()
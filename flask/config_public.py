@@ -4,11 +4,73 @@ import os
 class Config(object):
     SECRET_KEY = os.environ.get(
         'SECRET_KEY') or 'ASDFSASFDSDDSSWWERASD'
-    SERVER_NAME = 'localhost:5000'
+    # public host, e.g. 'shop.example.com', requests for other hosts get a 404 if set
+    SERVER_NAME = os.environ.get('SERVER_NAME')
+    # blueprints to register, e.g. BLUEPRINTS=payment for a worker only process
+    BLUEPRINTS = (os.environ.get('BLUEPRINTS') or 'frontend,payment').split(',')
+    SERVE_BIND = os.environ.get('SERVE_BIND') or '127.0.0.1:8000'  # address of 'flask serve'
+    SERVE_WORKERS = 2  # worker processes
+    SERVE_THREADS = 10  # requests per worker at once, AC_POOL_SIZE connections are kept alive
+    SERVE_TIMEOUT = 60  # seconds until a hanging worker is restarted
+    SERVE_GRACEFUL_TIMEOUT = 30  # seconds running requests get on restarts
+    SERVE_KEEPALIVE = 5  # seconds an idle client connection is kept open
+    SERVE_MAX_REQUESTS = 1000  # requests until a worker is replaced
+    SERVE_MAX_REQUESTS_JITTER = 100  # spreads the worker replacements
+    SERVE_REQUEST_TIMEOUT = 30  # deadline of a request for its upstream calls
+    SERVE_WEBHOOK_TIMEOUT = 10  # deadline of the Stripe webhook
+    SLOW_REQUEST_THRESHOLD = 1.0  # requests taking longer are logged with their upstream calls
+    DATA_DIR = os.environ.get('DATA_DIR') or 'data'  # local databases
     AC_KEY = "***"
     AC_URL = "https://***.api-us1.com/api/3/"
+    AC_FIELD_CACHE_TTL = 300  # seconds until custom field ids are reloaded
+    AC_POOL_SIZE = 10  # keep-alive connections per worker process
+    AC_TIMEOUT = (3.05, 15)  # connect and read timeout in seconds
+    AC_RETRIES = 3  # retries of failed idempotent requests (GET, PUT)
+    AC_RETRY_BACKOFF = 0.5  # backoff factor between retries
+    AC_BUDGET = 20  # seconds a flow of several AC requests like put_deal may take
+    AC_RATE_LIMIT = 5  # requests per second of all processes together, the account quota
+    AC_RATE_BURST = 5  # requests sent at once after an idle period
+    AC_RATE_DB = os.path.join(DATA_DIR, 'ac_rate.sqlite')  # token bucket shared by all processes
+    AC_RATE_INTERACTIVE_RESERVE = 2  # tokens batch requests leave to web requests
+    AC_THROTTLE_RETRIES = 5  # resends of requests throttled by AC (429)
+    AC_ASYNC_MAX_IN_FLIGHT = 20  # concurrent requests of one async client
+    AC_PREFETCH_WORKERS = 4  # threads requesting the next page of list endpoints
+    ONBOARDING_WORKERS = 8  # threads assigning tags and lists to new contacts
+    AC_DEAL_INDEX = os.path.join(DATA_DIR, 'deal_index.sqlite')
+    AC_MIRROR_DB = os.path.join(DATA_DIR, 'ac_mirror.sqlite')  # local copy of the tags and lists
+    AC_MIRROR_REFRESH = 300  # seconds after which the tags and lists are reloaded from AC
+    AC_WEBHOOK_TOKEN = os.environ.get('AC_WEBHOOK_TOKEN') or "***"  # secret part of the webhook url
+    BREAKER_THRESHOLD = 5  # failures in a row after which a service isn't called anymore
+    BREAKER_RESET_TIMEOUT = 30  # seconds until a failing service is tried again
+    METRICS_DB = os.path.join(DATA_DIR, 'metrics.sqlite')  # metrics of all processes for /metrics
+    METRICS_FLUSH_INTERVAL = 5  # seconds between stores of the metrics of a process
+    JOBS_DB = os.path.join(DATA_DIR, 'jobs.sqlite')  # queue of background jobs
+    JOBS_POLL_INTERVAL = 1  # seconds the worker waits if no job is due
+    JOBS_MAX_ATTEMPTS = 8  # failed jobs are retried until this many attempts
+    JOBS_RETRY_BACKOFF = 30  # seconds before the first retry, doubled per attempt
+    JOBS_LEASE = 600  # seconds after which a running job is considered lost
+    JOBS_RETENTION = 7 * 24 * 3600  # seconds done jobs are kept, longer than Stripe retries events
+    CATALOG_CHECK_INTERVAL = 2  # seconds between checks if gutscheine.json changed
+    PAGE_CACHE_MAX_AGE = 60  # seconds browsers may reuse cached pages unchecked
     STRIPE_PUBLIC_KEY = "pk_test_***"
     STRIPE_SECRET_KEY = "sk_test_***"
+    STRIPE_WEBHOOK_SECRET = "whsec_***"
+    STRIPE_PRICES_DB = os.path.join(DATA_DIR, 'stripe_prices.sqlite')  # synced prices
+    STRIPE_TIMEOUT = (3.05, 20)  # connect and read timeout in seconds
+    STRIPE_BUDGET = 30  # seconds the Stripe requests for an order confirmation may take
     SENDGRID_API_KEY = "SG.***"
+    SENDGRID_TIMEOUT = 10  # timeout of a SendGrid request in seconds
+    SENDGRID_BUDGET = 20  # seconds the confirmation mails of an order may take
+    SENDGRID_HOST = "https://api.sendgrid.com"
     SENDER_MAIL = "order@salina.maris.ch"
-    INTERNAL_MAIL = "info@salina.maris.ch"
\ No newline at end of file
+    INTERNAL_MAIL = "info@salina.maris.ch"
+    CUSTOMER_MAIL_TEMPLATE = "d-1a92894c9c42498cbd374782cfb87947"
+    INTERNAL_MAIL_TEMPLATE = "d-95cb04609d3e44beb088e5ec1c1bf093"
+    # template for customer and internal confirmation in one request, gets the flag 'internal'
+    ORDER_MAIL_TEMPLATE = None
+    # template for the digest of internal confirmations, None disables the digest
+    MAIL_DIGEST_TEMPLATE = None
+    MAIL_DIGEST_THRESHOLD = 20  # orders per window from which on the digest is used
+    MAIL_DIGEST_WINDOW = 600  # seconds
+    MAIL_DIGEST_INTERVAL = 900  # seconds an order waits at most for its digest
+    MAIL_DIGEST_MAX_ITEMS = 50  # orders per digest mail
\ No newline at end of file
@@ -1,45 +1,69 @@
-from project.blueprints.frontend import frontend
-from project.blueprints.payment import payment
+from importlib import import_module
+
 from flask import Flask, render_template
 from config import Config
-import logging
-import os
 
 from project.extensions import csrf, assets
 from project.bundles import bundles
+from project import ac_limiter, ac_mirror, cli, deadline, log, metrics, resilience, serve, static_build
+
+# blueprints which can be enabled, name: module providing the blueprint
+available_blueprints = {
+    'frontend': 'project.blueprints.frontend',
+    'payment': 'project.blueprints.payment',
+}
+
 
-from logging.handlers import RotatingFileHandler
+def create_app(config=Config, blueprints=None):
+    """Creates the app with the given blueprints
 
-app = Flask(__name__)
-app.config.from_object(Config)
+    The AC rate limit, the circuit breakers, the deadline budgets, the page
+    cache, the catalog, Stripe and SendGrid read their settings from the
+    app's config. The AC connection, the database paths and the jobs
+    settings are used outside of the app as well, they are read from
+    config.Config when their module is imported and a different `config`
+    doesn't change them.
 
-# Set up logger
-if not app.debug:
-    if not os.path.exists('logs'):
-        os.mkdir('logs')
-    file_handler = RotatingFileHandler('logs/project.log', maxBytes=10240,
-                                       backupCount=10)
-    file_handler.setFormatter(logging.Formatter(
-        '%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]'))
-    file_handler.setLevel(logging.INFO)
-    app.logger.addHandler(file_handler)
+    Args:
+      config: object the configuration is loaded from
+      blueprints: names of the blueprints to register, defaults to the
+        BLUEPRINTS config. A blueprint's module, and with it the SDKs it
+        uses, is only imported if the blueprint is enabled.
+    """
+    app = Flask(__name__)
+    app.config.from_object(config)
 
-    app.logger.setLevel(logging.INFO)
+    # Set up logger
+    log.init_app(app)
     app.logger.info('project startup')
 
-# import and register blueprints
-app.register_blueprint(frontend)
-app.register_blueprint(payment)
-# init extensions
-csrf.init_app(app)
-assets.init_app(app)
+    # import and register blueprints
+    if blueprints is None:
+        blueprints = app.config['BLUEPRINTS']
+    for name in blueprints:
+        module = import_module(available_blueprints[name])
+        app.register_blueprint(getattr(module, name))
+    # init extensions
+    csrf.init_app(app)
+    assets.init_app(app)
+    metrics.init_app(app)
+    ac_limiter.init_app(app)
+    deadline.init_app(app)
+    resilience.init_app(app)
+    serve.init_app(app)
+    ac_mirror.init_app(app)
+    cli.init_app(app)
 
-# register static bundles
-assets.register('js_bundle', bundles['js_bundle'])
-assets.register('css_bundle', bundles['css_bundle'])
+    # register static bundles
+    if 'js_bundle' not in assets:
+        assets.register('js_bundle', bundles['js_bundle'])
+        assets.register('css_bundle', bundles['css_bundle'])
+    # serve prebuilt bundles if 'flask static build' was run
+    static_build.init_app(app)
 
+    @app.errorhandler(404)
+    def page_not_found(e):
+        # note that we set the 404 status explicitly
+        return render_template('404.html'), 404
 
-@app.errorhandler(404)
-def page_not_found(e):
-    # note that we set the 404 status explicitly
-    return render_template('404.html'), 404
+    return app
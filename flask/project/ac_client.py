@@ -0,0 +1,154 @@
+from email.utils import parsedate_to_datetime
+import os
+import threading
+import time
+
+from config import Config
+
+from project.ac_limiter import limiter
+from project.deadline import DeadlineExceeded, clamp_timeout, expired, remaining
+from project.metrics import observe_upstream
+from project.resilience import breakers, outcome
+
+_headers = {"Api-Token": Config.AC_KEY}
+_url = Config.AC_URL
+
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+
+
+def _create_session():
+    """Create a keep-alive session with a connection pool
+
+    Failed requests are retried by request(), where every attempt takes a
+    token of the rate limiter and a timeout shortened to the deadline.
+    """
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    adapter = HTTPAdapter(pool_connections=1,
+                          pool_maxsize=Config.AC_POOL_SIZE)
+
+    session = requests.Session()
+    session.headers.update(_headers)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def get_session():
+    """Returns the session of the current process
+
+    Pooled connections must not be shared with forked worker processes,
+    therefore every process creates its own session on first use.
+    """
+    global _session, _session_pid
+
+    pid = os.getpid()
+    if _session is None or _session_pid != pid:
+        with _session_lock:
+            if _session is None or _session_pid != pid:
+                _session = _create_session()
+                _session_pid = pid
+    return _session
+
+
+def _retry_after(response):
+    """seconds to wait as requested by a 429 response, defaults to 1"""
+    value = response.headers.get("Retry-After", "")
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0)
+    except (TypeError, ValueError, AttributeError):
+        return 1
+
+
+def request(method: str, endpoint: str, **kwargs):
+    """Send a request to the specified endpoint of the AC api
+
+    Every request takes a token of the process wide rate limiter first.
+    Throttled requests (429) were not processed by AC, so they are sent
+    again after the Retry-After period, which pauses all other requests too.
+    Idempotent requests (GET, PUT) are retried on server errors and broken
+    connections, a POST might have been processed already. The timeout of
+    every attempt is shortened to the deadline of the current request, and
+    while AC keeps failing the circuit breaker rejects requests right away.
+    """
+    from requests.exceptions import ConnectionError, Timeout
+
+    breaker = breakers["ac"]
+    timeout = kwargs.pop("timeout", Config.AC_TIMEOUT)
+    retries = Config.AC_RETRIES if method.upper() in ("GET", "PUT") else 0
+    attempt = throttled = 0
+    while True:
+        # fail fast while AC is unhealthy
+        breaker.allow()
+        try:
+            limiter.acquire()
+            # don't wait for AC longer than the request may take
+            kwargs["timeout"] = clamp_timeout(timeout)
+        except Exception:
+            breaker.record(None)
+            raise
+
+        start = time.perf_counter()
+        try:
+            response = get_session().request(method, _url+endpoint, **kwargs)
+        except Exception as err:
+            observe_upstream("ac", endpoint, type(err).__name__,
+                             time.perf_counter() - start)
+            if expired():
+                # the timeout was shortened to the deadline
+                breaker.record(None)
+                raise DeadlineExceeded() from err
+            breaker.record(outcome(err))
+            if not isinstance(err, (ConnectionError, Timeout)) or \
+                    not _backoff(attempt, retries):
+                raise
+            attempt += 1
+            continue
+        observe_upstream("ac", endpoint, response.status_code,
+                         time.perf_counter() - start)
+        breaker.record(response.status_code < 500)
+
+        if response.status_code == 429 and throttled < Config.AC_THROTTLE_RETRIES:
+            throttled += 1
+            limiter.pause(_retry_after(response))
+            continue
+        if response.status_code not in (500, 502, 503, 504) or \
+                not _backoff(attempt, retries):
+            return response
+        response.close()
+        attempt += 1
+
+
+def _backoff(attempt: int, retries: int):
+    """Waits before the next retry, False if none is left before the deadline"""
+    backoff = Config.AC_RETRY_BACKOFF * 2 ** attempt
+    left = remaining()
+    if attempt >= retries or (left is not None and left <= backoff):
+        return False
+    time.sleep(backoff)
+    return True
+
+
+def get_response(endpoint: str, params: dict = {}, stream: bool = False):
+    """Send a GET request to the specified endpoint
+
+    With stream the body is read on access, close the response when done.
+    """
+    return request("GET", endpoint, params=params, stream=stream)
+
+
+def post_object(endpoint: str, data: dict):
+    """Send a POST request to the specified endpoint using data as body"""
+    return request("POST", endpoint, json=data)
+
+
+def put_object(endpoint: str, id: int, data: dict):
+    """Send a PUT request to the specified endpoint using data as body"""
+    return request("PUT", f'{endpoint}/{id}', json=data)
@@ -0,0 +1,198 @@
+from contextlib import contextmanager
+import heapq
+import itertools
+import threading
+import time
+
+from config import Config
+
+from project import storage
+from project.deadline import DeadlineExceeded, remaining
+
+# request priorities, lower values are served first
+INTERACTIVE = 0
+BATCH = 10
+
+_local = threading.local()
+
+# token bucket shared by all processes, see RateLimiter.configure
+_schema = """
+CREATE TABLE IF NOT EXISTS bucket (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    tokens REAL NOT NULL,
+    updated REAL NOT NULL,
+    paused_until REAL NOT NULL
+);
+"""
+
+
+def current_priority():
+    """priority of the requests sent by the current thread"""
+    return getattr(_local, "priority", INTERACTIVE)
+
+
+@contextmanager
+def priority(level: int):
+    """Sends the AC requests of the enclosed block with this priority
+
+    Web requests use INTERACTIVE by default, wrap batch and sync jobs with
+    'with priority(BATCH):' so they only use the capacity left over.
+    """
+    previous = current_priority()
+    _local.priority = level
+    try:
+        yield
+    finally:
+        _local.priority = previous
+
+
+class RateLimiter(object):
+    """Token bucket shared by all threads of the process
+
+    Tokens are refilled at `rate` per second up to `burst`. Threads waiting
+    for a token are served by priority first and in arrival order second.
+    With a database path the bucket is shared by all processes using it,
+    e.g. the web workers, 'flask worker' and the sync commands, so together
+    they stay within the account quota. Requests with a lower priority than
+    INTERACTIVE then leave `reserve` tokens to the web requests of the other
+    processes.
+
+    Args:
+      rate: requests per second
+      burst: maximal number of requests sent at once after an idle period
+    """
+
+    def __init__(self, rate: float, burst: int):
+        self._rate = rate
+        self._burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._paused_until = 0
+        self._path = None
+        self._reserve = 0
+        self._waiting = []
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+
+    def configure(self, rate: float, burst: int, path: str = None, reserve: int = 0):
+        """Changes rate and burst, with path the bucket is shared between processes
+
+        Args:
+          path: sqlite database holding the shared bucket, None for a bucket
+            of this process only
+          reserve: tokens kept for INTERACTIVE requests of a shared bucket
+        """
+        with self._cond:
+            self._refill(time.monotonic())
+            self._rate = rate
+            self._burst = burst
+            self._tokens = min(self._tokens, burst)
+            self._path = path
+            self._reserve = min(reserve, burst - 1)
+            self._cond.notify_all()
+
+    def _refill(self, now):
+        self._tokens = min(self._burst, self._tokens +
+                           (now - self._updated) * self._rate)
+        self._updated = now
+
+    def _take(self, priority: int, now: float):
+        """Takes a token if there is one, else returns the seconds to wait"""
+        if self._path is not None:
+            return self._take_shared(priority)
+        self._refill(now)
+        delay = max(self._paused_until - now, (1 - self._tokens) / self._rate)
+        if delay <= 0:
+            self._tokens -= 1
+        return delay
+
+    def _shared(self):
+        """the shared bucket as (tokens, paused_until) refilled until now, call in a transaction"""
+        db = storage.connect(self._path, _schema)
+        row = db.execute("SELECT tokens, updated, paused_until FROM bucket").fetchone()
+        if row is None:
+            return self._burst, 0
+        return min(self._burst, row["tokens"] + (time.time() - row["updated"]) * self._rate), \
+            row["paused_until"]
+
+    def _store_shared(self, tokens: float, paused_until: float):
+        storage.connect(self._path, _schema).execute(
+            "INSERT OR REPLACE INTO bucket (id, tokens, updated, paused_until) VALUES (1, ?, ?, ?)",
+            (tokens, time.time(), paused_until))
+
+    def _take_shared(self, priority: int):
+        # the wall clock is the same for all processes
+        reserve = self._reserve if priority > INTERACTIVE else 0
+        db = storage.connect(self._path, _schema)
+        with storage.within_deadline(db), storage.transaction(db, immediate=True):
+            tokens, paused_until = self._shared()
+            delay = max(paused_until - time.time(), (1 + reserve - tokens) / self._rate)
+            if delay <= 0:
+                tokens -= 1
+            self._store_shared(tokens, paused_until)
+        return delay
+
+    def acquire(self, priority: int = None):
+        """Blocks until the caller may send one request
+
+        Raises: DeadlineExceeded if the token can't be had before the
+          deadline of the current request
+        """
+        if priority is None:
+            priority = current_priority()
+
+        with self._cond:
+            ticket = (priority, next(self._counter))
+            heapq.heappush(self._waiting, ticket)
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._refill(now)
+                    left = remaining()
+                    if left is not None and left <= 0:
+                        raise DeadlineExceeded()
+                    if self._waiting[0] != ticket:
+                        # wait until the threads ahead got their tokens
+                        self._cond.wait(left)
+                        continue
+
+                    delay = self._take(priority, now)
+                    if delay <= 0:
+                        heapq.heappop(self._waiting)
+                        self._cond.notify_all()
+                        return
+                    if left is not None and delay > left:
+                        # e.g. paused by a Retry-After, don't wait in vain
+                        raise DeadlineExceeded()
+                    self._cond.wait(delay)
+            except BaseException:
+                self._waiting.remove(ticket)
+                heapq.heapify(self._waiting)
+                self._cond.notify_all()
+                raise
+
+    def pause(self, seconds: float):
+        """Sends no requests for seconds, e.g. as told by a Retry-After header"""
+        with self._cond:
+            self._paused_until = max(self._paused_until,
+                                     time.monotonic() + seconds)
+            self._tokens = min(self._tokens, 0)
+            if self._path is not None:
+                db = storage.connect(self._path, _schema)
+                with storage.transaction(db, immediate=True):
+                    tokens, paused_until = self._shared()
+                    self._store_shared(min(tokens, 0), max(paused_until, time.time() + seconds))
+
+
+limiter = RateLimiter(Config.AC_RATE_LIMIT, Config.AC_RATE_BURST)
+
+
+def init_app(app):
+    """Shares the AC quota of AC_RATE_LIMIT between all processes of the app
+
+    The bucket is kept in AC_RATE_DB. Batch jobs like 'flask deals sync'
+    leave AC_RATE_INTERACTIVE_RESERVE tokens to the web requests.
+    """
+    limiter.configure(app.config['AC_RATE_LIMIT'], app.config['AC_RATE_BURST'],
+                      path=app.config['AC_RATE_DB'],
+                      reserve=app.config['AC_RATE_INTERACTIVE_RESERVE'])
@@ -0,0 +1,242 @@
+import hmac
+import threading
+import time
+import warnings
+
+from flask import abort, jsonify, request
+
+from config import Config
+
+from project import jobs, storage
+from project.ac_paging import iter_lists, iter_tags
+from project.deadline import deadline
+from project.extensions import csrf
+
+_schema = """
+CREATE TABLE IF NOT EXISTS objects (
+    kind TEXT NOT NULL,
+    id TEXT NOT NULL,
+    name TEXT NOT NULL,
+    PRIMARY KEY (kind, id)
+);
+CREATE TABLE IF NOT EXISTS meta (
+    kind TEXT PRIMARY KEY,
+    version INTEGER NOT NULL,
+    refreshed REAL NOT NULL
+);
+"""
+
+
+def _db():
+    return storage.connect(Config.AC_MIRROR_DB, _schema)
+
+
+class Mirror(object):
+    """Local copy of AC objects like tags, looked up by exact name in memory
+
+    The objects are kept in a database shared by all processes, every
+    process holds them as dicts name -> id and id -> name. Lookups check
+    at most every `check_interval` seconds if another process changed the
+    database, and refresh the copy from AC if a name is unknown, at most
+    every `miss_interval` seconds. Copies older than `max_age` seconds are
+    refreshed by refresh_if_stale, which the worker runs, not by lookups.
+
+    Args:
+      kind: name of the objects, e.g. 'tags'
+      loader: callable without arguments returning a dict id -> name from AC
+      max_age: seconds after which the copy is refreshed
+    """
+
+    def __init__(self, kind: str, loader, max_age: float, miss_interval: float = 10,
+                 check_interval: float = 1):
+        self.kind = kind
+        self._loader = loader
+        self._max_age = max_age
+        self._miss_interval = miss_interval
+        self._check_interval = check_interval
+        self._ids = {}
+        self._names = {}
+        self._version = None
+        self._checked_at = None
+        self._refreshed_at = None
+        self._refresh_lock = threading.Lock()
+
+    def _set(self, names: dict, version: int):
+        """replaces the in-memory indexes, names is a dict id -> name"""
+        ids = {}
+        # the object with the lowest id wins if a name is used twice
+        for id in sorted(names, key=int):
+            ids.setdefault(names[id], id)
+        self._ids, self._names, self._version = ids, names, version
+
+    def _meta(self):
+        return _db().execute("SELECT version, refreshed FROM meta WHERE kind = ?",
+                             (self.kind,)).fetchone()
+
+    def load(self):
+        """Reads the copy from the database, e.g. to warm up at start up
+
+        Returns: number of objects
+        """
+        with storage.transaction(_db()) as db:
+            meta = db.execute("SELECT version FROM meta WHERE kind = ?", (self.kind,)).fetchone()
+            rows = db.execute("SELECT id, name FROM objects WHERE kind = ?",
+                              (self.kind,)).fetchall()
+        self._set({r["id"]: r["name"] for r in rows}, meta["version"] if meta else None)
+        self._checked_at = time.monotonic()
+        return len(rows)
+
+    def warm_up(self):
+        """Reads the copy from the database, loads it from AC if there is none yet
+
+        Returns: number of objects
+        """
+        count = self.load()
+        if self._version is None:
+            self.refresh()
+            count = len(self._names)
+        return count
+
+    def refresh(self):
+        """Loads all objects from AC and stores the changes
+
+        Returns: number of added, renamed and removed objects
+        """
+        with self._refresh_lock:
+            return self._refresh()
+
+    def _refresh(self):
+        self._refreshed_at = time.monotonic()
+        # AC can't filter tags or lists by modification date, so all of
+        # them are listed and only the differences are written
+        current = {str(k): v for k, v in self._loader().items()}
+
+        with storage.transaction(_db(), immediate=True) as db:
+            stored = {r["id"]: r["name"] for r in db.execute(
+                "SELECT id, name FROM objects WHERE kind = ?", (self.kind,))}
+            changed = [(self.kind, id, name) for id, name in current.items()
+                       if stored.get(id) != name]
+            removed = [(self.kind, id) for id in stored if id not in current]
+            db.executemany("INSERT OR REPLACE INTO objects (kind, id, name) VALUES (?, ?, ?)",
+                           changed)
+            db.executemany("DELETE FROM objects WHERE kind = ? AND id = ?", removed)
+
+            meta = db.execute("SELECT version FROM meta WHERE kind = ?",
+                              (self.kind,)).fetchone()
+            version = (meta["version"] if meta else 0) + (1 if changed or removed else 0)
+            db.execute("INSERT OR REPLACE INTO meta (kind, version, refreshed) VALUES (?, ?, ?)",
+                       (self.kind, version, time.time()))
+
+        self._set(current, version)
+        self._checked_at = time.monotonic()
+        return len(changed) + len(removed)
+
+    def refresh_if_stale(self):
+        """Refreshes the copy if it is older than max_age seconds
+
+        Otherwise the copy is reloaded if another process changed it. A
+        refresh running in another thread is not waited for.
+        Returns: True if it was refreshed
+        """
+        meta = self._meta()
+        if meta is None or time.time() - meta["refreshed"] > self._max_age:
+            if not self._refresh_lock.acquire(blocking=False):
+                return False
+            try:
+                self._refresh()
+            finally:
+                self._refresh_lock.release()
+            return True
+        if meta["version"] != self._version:
+            self.load()
+        return False
+
+    def _ensure(self, names):
+        """Reloads the copy if another process changed it, refreshes it if any of names is unknown"""
+        now = time.monotonic()
+        if self._checked_at is None or now - self._checked_at > self._check_interval:
+            self._checked_at = now
+            # a stale copy is refreshed by the worker, lookups don't wait for AC
+            meta = self._meta()
+            if meta is not None and meta["version"] != self._version:
+                self.load()
+        if any(n not in self._ids for n in names):
+            with self._refresh_lock:
+                # another thread may just have refreshed the copy
+                if self._refreshed_at is None or \
+                        time.monotonic() - self._refreshed_at > self._miss_interval:
+                    self._refresh()
+
+    def get_id(self, name: str):
+        """Finds the id of the object with exactly this name
+
+        Returns: id or None if there is no such object
+        """
+        self._ensure([name])
+        return self._ids.get(name)
+
+    def get_name(self, id):
+        """Finds the name of the object with this id, None if unknown"""
+        self._ensure([])
+        return self._names.get(str(id))
+
+    def resolve(self, names):
+        """Finds the ids of all names in one pass
+
+        Returns: dict name -> id, unknown names are mapped to None
+        """
+        names = list(names)
+        self._ensure(names)
+        ids = self._ids
+        return {n: ids.get(n) for n in names}
+
+
+tags = Mirror("tags", lambda: {t["id"]: t["tag"] for t in iter_tags()},
+              max_age=Config.AC_MIRROR_REFRESH)
+lists = Mirror("lists", lambda: {l["id"]: l["name"] for l in iter_lists()},
+               max_age=Config.AC_MIRROR_REFRESH)
+mirrors = (tags, lists)
+
+
+@jobs.handler("ac.mirror_refresh")
+def refresh_mirrors(payload):
+    """Refreshes the tags and lists, queued by the AC webhook"""
+    for mirror in mirrors:
+        mirror.refresh()
+
+
+def refresh_stale_mirrors():
+    """Refreshes the mirrors older than AC_MIRROR_REFRESH, run by the worker when idle"""
+    for mirror in mirrors:
+        mirror.refresh_if_stale()
+
+
+def init_app(app):
+    """Warms up the mirrors and receives AC webhooks
+
+    A mirror without a copy in the database yet is loaded from AC here, at
+    start up, instead of in the first request using it.
+
+    The webhook is registered in AC with the url
+    /ac/webhook/<AC_WEBHOOK_TOKEN> for events which may create tags or
+    lists, e.g. 'contact_tag_added'. It queues a refresh for the worker,
+    at most one every 10 seconds.
+    """
+    # https://developers.activecampaign.com/page/webhooks
+    # don't hold up the start for long while AC is unavailable
+    with deadline(app.config['AC_BUDGET']):
+        for mirror in mirrors:
+            try:
+                mirror.warm_up()
+            except Exception as err:
+                # unknown names are looked up in AC on first use
+                warnings.warn("Loading the AC {} failed: {}".format(mirror.kind, err))
+
+    @app.route("/ac/webhook/<token>", methods=["POST"])
+    @csrf.exempt
+    def ac_webhook(token):
+        if not hmac.compare_digest(token, app.config["AC_WEBHOOK_TOKEN"]):
+            abort(404)
+        jobs.enqueue("ac.mirror_refresh", {"type": request.form.get("type")},
+                     key="ac.mirror_refresh:{}".format(int(time.time() // 10)))
+        return jsonify(success="refresh queued"), 202
@@ -0,0 +1,207 @@
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+
+from config import Config
+
+from project.ac_client import get_response
+from project.ac_limiter import current_priority, priority
+from project.metrics import propagate
+
+# fetches the next page in the background while the current one is consumed
+_prefetcher = ThreadPoolExecutor(max_workers=Config.AC_PREFETCH_WORKERS,
+                                 thread_name_prefix="ac-prefetch")
+
+
+def _fetch_page(endpoint: str, params: dict, offset: int, level: int = None):
+    """Send a GET request for the page starting at offset"""
+    if level is not None:
+        # prefetching thread, use the priority of the consumer
+        with priority(level):
+            return _fetch_page(endpoint, params, offset)
+    response = get_response(endpoint, params=dict(params, offset=offset))
+    response.raise_for_status()
+    return response.json()
+
+
+def _has_more(total, count: int, offset: int, page_size: int):
+    """Checks if there are more objects after the page starting at offset
+
+    Args:
+      total: total number of matches from the meta data, None if unknown
+      count: number of objects on the page
+    """
+    # most list endpoints return the total number of matches in the meta data
+    if total is not None:
+        return offset + page_size < int(total)
+    return count >= page_size
+
+
+def iter_pages(endpoint: str, key: str, params: dict = {}, page_size: int = 100,
+               prefetch: bool = True):
+    """Yields the parsed pages of a paginated AC list endpoint
+
+    Pages are requested lazily using offset/limit pagination, while a page
+    is processed the next one is already requested in the background.
+    Closing the generator (e.g. by leaving a for loop) stops the iteration.
+
+    Args:
+      endpoint: the list endpoint, e.g. 'deals'
+      key: key of the list of objects in the response, e.g. 'deals'
+      params: query parameters like filters or sideloads
+      page_size: number of objects requested per page
+      prefetch: request the next page while the current one is processed
+    """
+    # https://developers.activecampaign.com/reference#pagination
+
+    params = dict(params, limit=page_size)
+    offset = 0
+    next_page = None
+    page = _fetch_page(endpoint, params, offset)
+
+    try:
+        while True:
+            has_more = _has_more(page.get("meta", {}).get("total"),
+                                 len(page.get(key, [])), offset, page_size)
+            if has_more and prefetch:
+                next_page = _prefetcher.submit(
+                    propagate(_fetch_page), endpoint, params, offset + page_size, current_priority())
+
+            yield page
+
+            if not has_more:
+                return
+            offset += page_size
+            if next_page is not None:
+                page = next_page.result()
+                next_page = None
+            else:
+                page = _fetch_page(endpoint, params, offset)
+    finally:
+        # stopped early, the prefetched page is not needed anymore
+        if next_page is not None:
+            next_page.cancel()
+
+
+def _parse_streamed(response, key: str, items: str, page: dict):
+    """Yields the objects of the list items while the response is read
+
+    The number of objects in the list key and the total from the meta data
+    are stored in page as 'count' and 'total'.
+    """
+    import ijson
+
+    raw = response.raw
+    # gzip encoded bodies are decoded by urllib3
+    raw.decode_content = True
+    item_prefix = items + ".item"
+    builder = None
+
+    for prefix, event, value in ijson.parse(raw, use_float=True):
+        if builder is not None:
+            builder.event(event, value)
+            if prefix == item_prefix and event == "end_map":
+                yield builder.value
+                builder = None
+            continue
+        if prefix == item_prefix and event == "start_map":
+            builder = ijson.ObjectBuilder()
+            builder.event(event, value)
+        if prefix == key + ".item" and event == "start_map":
+            page["count"] += 1
+        elif prefix == "meta.total":
+            page["total"] = value
+
+
+def iter_streamed(endpoint: str, key: str, items: str = None, params: dict = {},
+                  page_size: int = 100):
+    """Yields the objects of all pages while the responses are parsed
+
+    Unlike iter_objects a page is never held in memory as a whole, which
+    keeps large sideloads like 'dealCustomFieldData' cheap. Closing the
+    generator, e.g. when the object looked for is found, drops the unread
+    rest of the response. Falls back to iter_objects without ijson.
+
+    Args:
+      endpoint: the list endpoint, e.g. 'deals'
+      key: key of the paginated list of objects, e.g. 'deals'
+      items: key of the list to yield, e.g. a sideload, defaults to key
+      params: query parameters like filters or sideloads
+      page_size: number of objects requested per page
+    """
+    # https://developers.activecampaign.com/reference#pagination
+    items = items or key
+    try:
+        import ijson  # noqa: F401
+    except ImportError:
+        with closing(iter_pages(endpoint, key, params, page_size, prefetch=False)) as pages:
+            for page in pages:
+                yield from page.get(items, [])
+        return
+
+    params = dict(params, limit=page_size)
+    offset = 0
+    while True:
+        response = get_response(endpoint, params=dict(params, offset=offset), stream=True)
+        try:
+            response.raise_for_status()
+            page = {"count": 0, "total": None}
+            yield from _parse_streamed(response, key, items, page)
+        finally:
+            response.close()
+
+        if not _has_more(page["total"], page["count"], offset, page_size):
+            return
+        offset += page_size
+
+
+def iter_objects(endpoint: str, key: str, params: dict = {}, **kwargs):
+    """Yields the objects of all pages of a paginated AC list endpoint"""
+    with closing(iter_pages(endpoint, key, params, **kwargs)) as pages:
+        for page in pages:
+            yield from page.get(key, [])
+
+
+def find_object(endpoint: str, key: str, predicate, params: dict = {}, **kwargs):
+    """Finds the first object for which predicate is true
+
+    Stops requesting pages as soon as a match is found.
+    Returns: the object or None if no object matched
+    """
+    with closing(iter_objects(endpoint, key, params, **kwargs)) as objects:
+        return next((o for o in objects if predicate(o)), None)
+
+
+def iter_deals(params: dict = {}, **kwargs):
+    """Yields all deals matching params"""
+    # https://developers.activecampaign.com/reference#list-all-deals
+    return iter_objects("deals", "deals", params, **kwargs)
+
+
+def iter_contacts(params: dict = {}, **kwargs):
+    """Yields all contacts matching params"""
+    # https://developers.activecampaign.com/reference#list-all-contacts
+    return iter_objects("contacts", "contacts", params, **kwargs)
+
+
+def iter_tags(params: dict = {}, **kwargs):
+    """Yields all tags matching params"""
+    # https://developers.activecampaign.com/reference#retrieve-all-tags
+    return iter_objects("tags", "tags", params, **kwargs)
+
+
+def iter_lists(params: dict = {}, **kwargs):
+    """Yields all lists matching params"""
+    # https://developers.activecampaign.com/reference#retrieve-all-lists
+    return iter_objects("lists", "lists", params, **kwargs)
+
+
+def iter_fields(params: dict = {}, **kwargs):
+    """Yields all custom contact fields"""
+    # https://developers.activecampaign.com/reference#retrieve-fields-1
+    return iter_objects("fields", "fields", params, **kwargs)
+
+
+def iter_deal_fields(params: dict = {}, **kwargs):
+    """Yields all custom deal fields"""
+    # https://developers.activecampaign.com/reference#retrieve-all-dealcustomfielddata-resources
+    return iter_objects("dealCustomFieldMeta", "dealCustomFieldMeta", params, **kwargs)
@@ -0,0 +1,247 @@
+import asyncio
+from functools import partial
+import time
+
+import aiohttp
+from config import Config
+
+from project import ac_mirror, deal_index
+from project.ac_client import _retry_after
+from project.ac_limiter import BATCH, limiter
+from project.ac_paging import _has_more
+from project.deadline import DeadlineExceeded, clamp_timeout, expired, remaining
+from project.metrics import observe_upstream, propagate
+from project.resilience import breakers
+from project.api_contacts import _create_contact
+from project.api_deals import _create_deal, _is_reservationsnummer, deal_fields
+
+
+class AsyncClient(object):
+    """Asynchronous variant of the api_contacts and api_deals operations
+
+    All requests share one connection pool, a semaphore caps the number of
+    requests in flight, so many operations can be awaited concurrently:
+
+        async with AsyncClient() as ac:
+            contact, tag_id, list_id = await asyncio.gather(
+                ac.post_contact(contact), ac.get_tag_id("Wellness"),
+                ac.get_list_id("Marketing"))
+
+    The methods return the parsed AC response and raise
+    aiohttp.ClientResponseError if AC answers with an error status.
+    Requests share the rate limit of the process with the synchronous
+    modules, by default with BATCH priority, so web requests go first.
+    """
+
+    def __init__(self, max_in_flight: int = Config.AC_ASYNC_MAX_IN_FLIGHT,
+                 pool_size: int = Config.AC_POOL_SIZE, timeout=Config.AC_TIMEOUT,
+                 priority: int = BATCH):
+        self._max_in_flight = max_in_flight
+        self._pool_size = pool_size
+        self._timeout = aiohttp.ClientTimeout(
+            sock_connect=timeout[0], sock_read=timeout[1])
+        self._session = None
+        self._semaphore = None
+        self._priority = priority
+
+    async def __aenter__(self):
+        self._semaphore = asyncio.Semaphore(self._max_in_flight)
+        self._session = aiohttp.ClientSession(
+            headers={"Api-Token": Config.AC_KEY},
+            connector=aiohttp.TCPConnector(limit=self._pool_size),
+            timeout=self._timeout)
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def close(self):
+        """Closes all pooled connections"""
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def _request(self, method: str, endpoint: str, **kwargs):
+        """Send a request to the specified endpoint of the AC api
+
+        Every request takes a token of the process wide rate limiter first.
+        Throttled requests (429) are sent again after the Retry-After period,
+        idempotent requests (GET, PUT) are retried on server errors. Like
+        ac_client.request, the timeout is shortened to the deadline, the AC
+        circuit breaker is shared and the calls are recorded for /metrics.
+        """
+        breaker = breakers["ac"]
+        retries = Config.AC_RETRIES if method in ("GET", "PUT") else 0
+        attempt = throttled = 0
+        while True:
+            async with self._semaphore:
+                # fail fast while AC is unhealthy
+                breaker.allow()
+                try:
+                    # wait for the token in a thread, the event loop keeps running
+                    await self._run_sync(limiter.acquire, self._priority)
+                    # don't wait for AC longer than the request may take
+                    timeout = self._deadline_timeout()
+                except Exception:
+                    breaker.record(None)
+                    raise
+
+                start = time.perf_counter()
+                try:
+                    async with self._session.request(method, Config.AC_URL+endpoint,
+                                                     timeout=timeout, **kwargs) as response:
+                        # error bodies may not be json, e.g. from a gateway
+                        data = await response.json(content_type=None) \
+                            if response.status < 400 else None
+                except Exception as err:
+                    observe_upstream("ac", endpoint, type(err).__name__,
+                                     time.perf_counter() - start)
+                    if expired():
+                        # the timeout was shortened to the deadline
+                        breaker.record(None)
+                        raise DeadlineExceeded() from err
+                    breaker.record(False)
+                    raise
+                observe_upstream("ac", endpoint, response.status,
+                                 time.perf_counter() - start)
+                breaker.record(response.status < 500)
+
+            if response.status == 429 and throttled < Config.AC_THROTTLE_RETRIES:
+                # not processed by AC, pause all requests of the process
+                throttled += 1
+                limiter.pause(_retry_after(response))
+                continue
+            backoff = Config.AC_RETRY_BACKOFF * 2 ** attempt
+            left = remaining()
+            if response.status < 500 or attempt == retries or \
+                    (left is not None and left <= backoff):
+                response.raise_for_status()
+                return data
+            await asyncio.sleep(backoff)
+            attempt += 1
+
+    def _deadline_timeout(self):
+        """the client timeout, shortened to the deadline of the current request"""
+        left = remaining()
+        if left is None:
+            return self._timeout
+        connect, read = clamp_timeout((self._timeout.sock_connect, self._timeout.sock_read))
+        return aiohttp.ClientTimeout(total=left, sock_connect=connect, sock_read=read)
+
+    async def _run_sync(self, function, *args):
+        """Runs blocking code like cached field lookups in a thread
+
+        The thread shares the deadline and request statistics of the caller.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, propagate(partial(function, *args)))
+
+    async def get_list_id(self, list_name: str):
+        """Finds the internal id of the specified list, None if not found"""
+        # https://developers.activecampaign.com/reference#retrieve-all-lists
+        # unknown names refresh the local copy of all lists
+        return await self._run_sync(ac_mirror.lists.get_id, list_name)
+
+    async def get_tag_id(self, tag_name: str):
+        """Finds the internal id of the specified tag, None if not found"""
+        # https://developers.activecampaign.com/reference#retrieve-all-tags
+        # unknown names refresh the local copy of all tags
+        return await self._run_sync(ac_mirror.tags.get_id, tag_name)
+
+    async def post_contact(self, contact: dict):
+        """sends a contact to AC using the 'create or update' contact endpoint"""
+        # https://developers.activecampaign.com/reference#create-or-update-contact-new
+        ac_contact = await self._run_sync(_create_contact, contact)
+        return await self._request("POST", "contact/sync", json=ac_contact)
+
+    async def subscribe_contact_to_list(self, contact_id: int, list_id: int):
+        """subscribes a contact to the specified list"""
+        # https://developers.activecampaign.com/reference#update-list-status-for-contact
+        data = {"contactList": {
+            "list": list_id,
+            "contact": contact_id,
+            "status": 1,
+        }}
+        return await self._request("POST", "contactLists", json=data)
+
+    async def add_tag_to_contact(self, tag_id: int, contact_id: int):
+        """adds a tag to the specified contact"""
+        # https://developers.activecampaign.com/reference#contact-tags
+        data = {"contactTag": {
+            "contact": contact_id,
+            "tag": tag_id,
+        }}
+        return await self._request("POST", "contactTags", json=data)
+
+    async def post_deal(self, deal: dict):
+        """sends a new deal to AC using the 'create' deal endpoint"""
+        # https://developers.activecampaign.com/reference#create-a-deal-new
+        ac_deal = await self._run_sync(_create_deal, deal)
+        response = await self._request("POST", "deals", json=ac_deal)
+
+        # remember the new deal in the local Reservationsnummer index
+        if deal.get("Reservationsnummer") is not None:
+            deal_index.put(deal["Reservationsnummer"], response["deal"]["id"])
+        return response
+
+    async def find_deal_id(self, reservationsnummer: int, status: int = 0,
+                           contact_email: str = None):
+        """find deal by custom deal field 'Reservationsnummer'
+
+        Returns: The deal id or None if no deal found
+        """
+        # https://developers.activecampaign.com/reference#list-all-deals
+
+        ac_deal_id = deal_index.get(reservationsnummer)
+        if ac_deal_id:
+            return ac_deal_id
+
+        field_id = str(await self._run_sync(deal_fields.get_id, "Reservationsnummer"))
+        search_params = {"filters[stage]": status, "include": "dealCustomFieldData"}
+        if contact_email:
+            search_params["filters[search_field]"] = "email"
+            search_params["filters[search]"] = contact_email
+
+        # walk the pages until the sideloaded field data contains the Reservationsnummer
+        page_size = 100
+        search_params["limit"] = page_size
+        offset = 0
+        while True:
+            page = await self._request("GET", "deals", params=dict(search_params, offset=offset))
+            field = next(
+                (f for f in page.get("dealCustomFieldData", [])
+                 if _is_reservationsnummer(f, field_id, reservationsnummer)), None)
+            if field:
+                deal_index.put(reservationsnummer, field["deal_id"])
+                return field["deal_id"]
+            if not _has_more(page.get("meta", {}).get("total"), len(page.get("deals", [])),
+                             offset, page_size):
+                return None
+            offset += page_size
+
+    async def put_deal(self, reservationsnummer: int, data: dict, email=None):
+        """update deal with the respective 'Reservationsnummer'
+
+        Raises: LookupError if no open deal has this Reservationsnummer
+        """
+        # https://developers.activecampaign.com/reference#update-a-deal-new
+
+        async def find():
+            deal_id = await self.find_deal_id(reservationsnummer, contact_email=email)
+            if deal_id is None:
+                raise LookupError(
+                    "No open deal with Reservationsnummer {}".format(reservationsnummer))
+            return deal_id
+
+        deal_id, deal_object = await asyncio.gather(
+            find(), self._run_sync(_create_deal, data))
+        try:
+            return await self._request("PUT", f"deals/{deal_id}", json=deal_object)
+        except aiohttp.ClientResponseError as err:
+            if err.status != 404:
+                raise
+
+        # the indexed deal might have been deleted in AC, search it again
+        deal_index.remove(reservationsnummer)
+        deal_id = await find()
+        return await self._request("PUT", f"deals/{deal_id}", json=deal_object)
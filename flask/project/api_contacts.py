@@ -1,19 +1,31 @@
-import requests
+import threading
 import warnings
 from config import Config
 
-_headers = {"Api-Token": Config.AC_KEY}
-_url = Config.AC_URL
+from project import ac_mirror
+from project.ac_client import post_object as _post_object
+from project.ac_limiter import BATCH, priority
+from project.ac_paging import iter_fields
+from project.field_registry import FieldRegistry
+from project.streaming import bounded_map, chunked
 
 
-def _get_response(endpoint: str, params: dict = {}):
-    """Send a GET request to the specified endpoint"""
-    return requests.get(_url+endpoint, headers=_headers, params=params)
+# standard fields of a contact, the bulk import names them in snake case
+_standard_fields = {"email": "email", "firstName": "first_name",
+                    "lastName": "last_name", "phone": "phone"}
 
 
-def _post_object(endpoint: str, data: dict):
-    """Send a POST request to the specified endpoint using data as body"""
-    return requests.post(_url+endpoint, headers=_headers, json=data)
+def _load_custom_fields():
+    """Loads all custom fields as a dict title -> id"""
+    # https://developers.activecampaign.com/reference#retrieve-fields-1
+
+    # query all pages of the fields endpoint
+    return {f["title"]: f["id"] for f in iter_fields()}
+
+
+# cached title <-> id mapping of the contact custom fields
+contact_fields = FieldRegistry(
+    _load_custom_fields, ttl=Config.AC_FIELD_CACHE_TTL)
 
 
 def _get_custom_field_id(field_name: str):
@@ -21,16 +33,7 @@ def _get_custom_field_id(field_name: str):
 
     Returns: id of field or None if field not found.
     """
-    # https://developers.activecampaign.com/reference#retrieve-fields-1
-
-    # query fields endpoint, only use the list of fields
-    all_fields = _get_response("fields").json()["fields"]
-
-    # of those fields, find the first one where title is equal to the name searched
-    field = next(
-        (f for f in all_fields if f["title"] == field_name), {"id": None})
-
-    return field["id"]
+    return contact_fields.get_id(field_name)
 
 
 def get_list_id(list_name: str):
@@ -40,15 +43,8 @@ def get_list_id(list_name: str):
     """
     # https://developers.activecampaign.com/reference#retrieve-all-lists
 
-    # query all lists and filter by list name
-    lists = _get_response("lists", params={"filters[name]": list_name}).json()
-
-    # return None if no list by this name found
-    if len(lists["lists"]) < 1:
-        return None
-
-    # else return id of first list found
-    return lists["lists"][0]["id"]
+    # exact name lookup in the local copy of all lists
+    return ac_mirror.lists.get_id(list_name)
 
 
 def get_tag_id(tag_name: str):
@@ -58,15 +54,8 @@ def get_tag_id(tag_name: str):
     """
     # https://developers.activecampaign.com/reference#retrieve-all-tags
 
-    # query all tags and filter by tag name
-    tags = _get_response("tags", params={"search": tag_name}).json()
-
-    # return None if no tag by this name found
-    if len(tags["tags"]) < 1:
-        return None
-
-    # else return id of first tag found
-    return tags["tags"][0]["id"]
+    # exact name lookup in the local copy of all tags
+    return ac_mirror.tags.get_id(tag_name)
 
 
 def _create_contact(contact: dict):
@@ -80,15 +69,17 @@ def _create_contact(contact: dict):
 
     # init new object, fieldValues is a list of custom fields
     ac_contact = {"fieldValues": []}
-    fields = ["email", "firstName", "lastName", "phone"]  # standard fields
+
+    # get ids of all custom fields at once
+    field_ids = contact_fields.resolve(
+        k for k in contact if k not in _standard_fields)
 
     # write standard fields on first level, custom fields on second level into a list
     for k, v in contact.items():
-        if k in fields:
+        if k in _standard_fields:
             ac_contact[k] = v
         else:
-            # get id of custom field
-            id = _get_custom_field_id(k)
+            id = field_ids[k]
             if id:
                 ac_contact["fieldValues"].append({"field": id, "value": v})
             else:
@@ -136,3 +127,84 @@ def add_tag_to_contact(tag_id: int, contact_id: int):
     }}
     response = _post_object("contactTags", data)
     return response
+
+
+def _create_bulk_contact(contact: dict, field_ids: dict, tags: list, list_ids: list):
+    """Create contact object for the AC bulk import
+
+    Args:
+      contact: flat dictionary with all the information for the contact
+      field_ids: ids of the custom fields in contact, unknown fields are skipped
+      tags: names of the tags to add
+      list_ids: ids of the lists to subscribe to
+    Returns: contact object as used by the bulk import endpoint
+    """
+    # https://developers.activecampaign.com/reference#bulk-import-contacts
+
+    ac_contact = {"fields": [], "tags": list(tags),
+                  "subscribe": [{"listid": id} for id in list_ids]}
+
+    for k, v in contact.items():
+        if k in _standard_fields:
+            ac_contact[_standard_fields[k]] = v
+        elif field_ids.get(k):
+            ac_contact["fields"].append({"id": field_ids[k], "value": v})
+
+    return ac_contact
+
+
+def bulk_import_contacts(contacts, tags: list = [], lists: list = [],
+                         chunk_size: int = 250, workers: int = 4):
+    """sends contacts to AC in chunks using the bulk import endpoint
+
+    The contacts are read lazily, so any iterable (e.g. a file reader) works.
+    Args:
+      contacts: iterable of flat dictionaries as used by post_contact
+      tags: names of the tags added to every contact
+      lists: names of the lists every contact is subscribed to
+      chunk_size: contacts per request, AC accepts up to 250
+      workers: number of requests sent concurrently
+    Returns: dict with the number of imported and failed contacts, the errors
+      and the names of the unknown fields, which were not imported
+    """
+    # https://developers.activecampaign.com/reference#bulk-import-contacts
+
+    # resolve list names only once for all contacts
+    list_ids = []
+    for list_name, list_id in ac_mirror.lists.resolve(lists).items():
+        if list_id is None:
+            raise ValueError("The list {} is unknown.".format(list_name))
+        list_ids.append(list_id)
+
+    def send_chunk(chunk):
+        with priority(BATCH):
+            return _send_chunk(chunk)
+
+    unknown_fields = set()
+    unknown_lock = threading.Lock()
+
+    def _send_chunk(chunk):
+        field_ids = contact_fields.resolve(
+            {k for c in chunk for k in c if k not in _standard_fields})
+        with unknown_lock:
+            # warn once per field, not for every chunk
+            for k in sorted(k for k, id in field_ids.items()
+                            if not id and k not in unknown_fields):
+                unknown_fields.add(k)
+                warnings.warn("The field {} is unknown and was ignored.".format(k))
+        data = {"contacts": [_create_bulk_contact(c, field_ids, tags, list_ids)
+                             for c in chunk]}
+        response = _post_object("import/bulk_import", data)
+        response.raise_for_status()
+        return response
+
+    result = {"imported": 0, "failed": 0, "errors": []}
+    for chunk, _, error in bounded_map(send_chunk, chunked(contacts, chunk_size), workers):
+        if error:
+            result["failed"] += len(chunk)
+            result["errors"].append(str(error))
+        else:
+            result["imported"] += len(chunk)
+
+    result["unknown_fields"] = sorted(unknown_fields)
+    return result
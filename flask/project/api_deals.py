@@ -1,26 +1,36 @@
-import requests
+from contextlib import closing
+import hashlib
+import json
+import threading
 import warnings
 
-from requests.models import HTTPError
 from config import Config
 
-_headers = {"Api-Token": Config.AC_KEY}
-_url = Config.AC_URL
+from project.ac_client import post_object as _post_object, \
+    put_object as _put_object
+from project.ac_limiter import BATCH, priority
+from project.ac_paging import iter_deal_fields, iter_streamed
+from project.deadline import deadline
+from project.lazy import lazy_import
+from project.api_contacts import post_contact
+from project.field_registry import FieldRegistry
+from project.streaming import bounded_map
+from project import deal_index
 
+requests = lazy_import("requests")
 
-def _get_response(endpoint: str, params: dict = {}):
-    """Send a GET request to the specified endpoint"""
-    return requests.get(_url+endpoint, headers=_headers, params=params)
 
+def _load_custom_deal_fields():
+    """Loads all custom deal fields as a dict fieldLabel -> id"""
+    # https://developers.activecampaign.com/reference#retrieve-all-dealcustomfielddata-resources
 
-def _post_object(endpoint: str, data: dict):
-    """Send a POST request to the specified endpoint using data as body"""
-    return requests.post(_url+endpoint, headers=_headers, json=data)
+    # query all pages of the deal fields endpoint
+    return {f["fieldLabel"]: f["id"] for f in iter_deal_fields()}
 
 
-def _put_object(endpoint: str, id: int, data: dict):
-    """Send a PUT request to the specified endpoint using data as body"""
-    return requests.put(f'{_url}{endpoint}/{id}', headers=_headers, json=data)
+# cached fieldLabel <-> id mapping of the custom deal fields
+deal_fields = FieldRegistry(
+    _load_custom_deal_fields, ttl=Config.AC_FIELD_CACHE_TTL)
 
 
 def _get_custom_deal_field_id(field_name: str):
@@ -28,18 +38,7 @@ def _get_custom_deal_field_id(field_name: str):
 
     Returns: id of field or None if field not found.
     """
-    # https://developers.activecampaign.com/reference#retrieve-all-dealcustomfielddata-resources
-
-    # query deal fields endpoint, only use the list of fields
-    all_fields = _get_response("dealCustomFieldMeta").json()[
-        "dealCustomFieldMeta"]
-
-    # for those fields, find the first one where fieldLabel is equal to the name searched
-    field = next(
-        (f for f in all_fields if f["fieldLabel"] == field_name), {"id": None}
-    )
-
-    return field["id"]
+    return deal_fields.get_id(field_name)
 
 
 def _create_deal(deal: dict):
@@ -55,12 +54,14 @@ def _create_deal(deal: dict):
     ac_deal = {"currency": "chf", "group": "1", "fields": []}
     fields = ["contact", "title", "value", "currency", "group", "id"]
 
+    # get ids of all custom fields at once
+    field_ids = deal_fields.resolve(k for k in deal if k not in fields)
+
     for k, v in deal.items():
         if k in fields:
             ac_deal[k] = v
         else:
-            # get id of custom fields
-            id = _get_custom_deal_field_id(k)
+            id = field_ids[k]
             if id:
                 ac_deal["fields"].append(
                     {"customFieldId": id, "fieldValue": v})
@@ -84,22 +85,49 @@ def post_deal(deal: dict):
     ac_deal = _create_deal(deal)
     response = _post_object("deals", ac_deal)
 
+    # remember the new deal in the local Reservationsnummer index
+    if response.ok and deal.get("Reservationsnummer") is not None:
+        try:
+            deal_index.put(deal["Reservationsnummer"],
+                           response.json()["deal"]["id"])
+        except (ValueError, KeyError):
+            pass
+
     return response
 
 
+def _is_reservationsnummer(field: dict, field_id: str, reservationsnummer: int):
+    """True if field is the custom field field_id with the number value reservationsnummer
+
+    Fields without a valid number, e.g. with a null value, never match.
+    """
+    try:
+        return str(field["custom_field_id"]) == field_id and \
+            int(float(field["custom_field_number_value"])) == reservationsnummer
+    except (KeyError, TypeError, ValueError):
+        return False
+
+
 def _find_deal_id(reservationsnummer: int, status: int = 0, contact_email: str = None):
     """find deal by custom deal field 'Reservationsnummer'
 
-    The method searches by default all open (status=0) deals for the one with the respective RN
+    The method searches by default all open (status=0) deals for the one with the respective RN.
+    Deals found once are kept in a local index, later lookups don't query AC.
     Args: 
       reservationsnummer: the deal's "Reservationsnummer'
       status: defaults to 0=open, can also be 1=won or 2=lost
       contact_email: the linked contact's email, makes the query more efficient
     Returns:
       The deal id or None if no deal found
+    Raises: requests.HTTPError if AC answers the search with an error
     """
     # https://developers.activecampaign.com/reference#list-all-deals
 
+    # use the local index if the deal is already known
+    ac_deal_id = deal_index.get(reservationsnummer)
+    if ac_deal_id:
+        return ac_deal_id
+
     # filter by deal status, default all open deals
     search_params = {"filters[stage]": status}
 
@@ -111,44 +139,183 @@ def _find_deal_id(reservationsnummer: int, status: int = 0, contact_email: str =
         search_params["filters[search_field]"] = "email"
         search_params["filters[search]"] = contact_email
 
-    # execute the query
-    response = _get_response("deals", params=search_params)
+    # get the field id for Reservationsnummer from the cached deal fields
+    reservationsnummer_field_id = str(deal_fields.get_id("Reservationsnummer"))
 
-    # get the field id for Reservationsnummer
-    reservationsnummer_field_id = _get_custom_deal_field_id(
-        "Reservationsnummer")
-
-    try:
-        # check if request was successful
-        response.raise_for_status()
-        # get all customFieldData from all returned deals
-        ac_custom_fields = response.json()["dealCustomFieldData"]
-        # find the field where custom_field_id is reservationsnummer_field_id and the number vaulue is the reservationsnummer
+    # parse the field data while it is received, stop as soon as the deal is found
+    with closing(iter_streamed("deals", "deals", "dealCustomFieldData",
+                               params=search_params)) as fields:
         ac_reservationsnummer_field = next(
-            (f for f in ac_custom_fields if f["custom_field_id"] ==
-             reservationsnummer_field_id and int(float(f["custom_field_number_value"])) == reservationsnummer), None
-        )
-        # return theid of the deal to which this fiel belongs
-        ac_deal_id = ac_reservationsnummer_field["deal_id"]
+            (f for f in fields
+             if _is_reservationsnummer(f, reservationsnummer_field_id, reservationsnummer)), None)
 
-    except Exception as err:
-        return {"error": str(err)}
+    if ac_reservationsnummer_field is None:
+        return None
 
+    # return the id of the deal to which this field belongs
+    ac_deal_id = ac_reservationsnummer_field["deal_id"]
+    deal_index.put(reservationsnummer, ac_deal_id)
     return ac_deal_id
 
 
+def _error_response(status: int, message: str):
+    """response with an AC like error body for failures detected locally"""
+    response = requests.Response()
+    response.status_code = status
+    response.reason = message
+    response.url = Config.AC_URL + "deals"
+    response.headers["Content-Type"] = "application/json"
+    response._content = json.dumps({"errors": [{"title": message}]}).encode("utf-8")
+    return response
+
+
+def sync_deal_index():
+    """Adds all deals updated since the last sync to the local index
+
+    Returns: number of indexed Reservationsnummern
+    """
+    return deal_index.sync(deal_fields.get_id("Reservationsnummer"))
+
+
+@deadline('AC_BUDGET')
 def put_deal(reservationsnummer: int, data: dict, email=None):
     """update deal with the respective 'Reservationsnummer'
 
+    Finding and updating the deal share AC_BUDGET seconds.
+
     Args:
       reservationsnummer: custom field 'Reservationsnummer'
       data: new deal data which should update the existing deal
       email: contact's email, makes it more efficient to find the deal
+    Returns: the AC response, if no deal is found or the search fails an
+      error response without sending the update
     """
     # https://developers.activecampaign.com/reference#update-a-deal-new
 
-    deal_id = _find_deal_id(reservationsnummer, contact_email=email)
+    def find():
+        try:
+            deal_id = _find_deal_id(reservationsnummer, contact_email=email)
+        except requests.HTTPError as err:
+            # AC answered the search with an error, connection problems, an
+            # open circuit or the deadline are raised
+            return None, _error_response(err.response.status_code, str(err))
+        if deal_id is None:
+            return None, _error_response(
+                404, "No open deal with Reservationsnummer {}".format(reservationsnummer))
+        return deal_id, None
+
+    deal_id, error = find()
+    if error is not None:
+        return error
     deal_object = _create_deal(data)
     response = _put_object("deals", deal_id, deal_object)
 
+    # the indexed deal might have been deleted in AC, search it again
+    if response.status_code == 404:
+        deal_index.remove(reservationsnummer)
+        deal_id, error = find()
+        if error is not None:
+            return error
+        response = _put_object("deals", deal_id, deal_object)
+
     return response
+
+
+def _fingerprint(reservation: dict):
+    """hash of all reservation data which is synced to AC"""
+    data = json.dumps(reservation, sort_keys=True, default=str)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+def _push_reservation(reservation: dict):
+    """creates or updates the deal of one reservation
+
+    Returns: tuple ('created' or 'updated', deal id)
+    """
+    deal = dict(reservation)
+    email = deal.pop("email", None)
+    reservationsnummer = deal["Reservationsnummer"]
+
+    with priority(BATCH):
+        if deal_index.get(reservationsnummer):
+            action = "updated"
+            response = put_deal(reservationsnummer, deal, email=email)
+        else:
+            action = "created"
+            if "contact" not in deal and email:
+                # new deals need a contact, create it if it doesn't exist
+                contact = post_contact({"email": email})
+                contact.raise_for_status()
+                deal["contact"] = contact.json()["contact"]["id"]
+            response = post_deal(deal)
+
+    response.raise_for_status()
+    return action, response.json()["deal"]["id"]
+
+
+def sync_reservations(reservations, workers: int = 4):
+    """sends new and changed reservations to AC as deals
+
+    The reservations are read lazily, so any iterable (e.g. a file reader)
+    works. Each one is compared to the data last synced for its
+    Reservationsnummer, unchanged ones are skipped. Known deals are updated,
+    the others created. Rows with the same Reservationsnummer are sent one
+    after the other in their order, the last one wins.
+    Args:
+      reservations: iterable of flat dictionaries as used by post_deal with
+        the 'Reservationsnummer', optionally the contact's 'email'
+      workers: number of deals sent concurrently
+    Returns: dict with the number of created, updated, unchanged and failed
+      reservations and the errors
+    """
+    # the index tells which reservations already have a deal
+    sync_deal_index()
+
+    result = {"created": 0, "updated": 0, "unchanged": 0, "failed": 0, "errors": []}
+
+    # Reservationsnummern being sent, a later row with the same number waits
+    # for it, otherwise both could miss the index and create a deal each
+    in_flight = set()
+    in_flight_changed = threading.Condition()
+
+    def changed():
+        for reservation in reservations:
+            try:
+                reservation = dict(reservation, Reservationsnummer=int(
+                    float(reservation["Reservationsnummer"])))
+            except (KeyError, TypeError, ValueError):
+                result["failed"] += 1
+                result["errors"].append("no valid Reservationsnummer: {}".format(reservation))
+                continue
+            reservationsnummer = reservation["Reservationsnummer"]
+            with in_flight_changed:
+                in_flight_changed.wait_for(lambda: reservationsnummer not in in_flight)
+            fingerprint = _fingerprint(reservation)
+            if deal_index.get_fingerprint(reservationsnummer) == fingerprint:
+                result["unchanged"] += 1
+            else:
+                with in_flight_changed:
+                    in_flight.add(reservationsnummer)
+                yield fingerprint, reservation
+
+    def push(item):
+        fingerprint, reservation = item
+        reservationsnummer = reservation["Reservationsnummer"]
+        try:
+            action, deal_id = _push_reservation(reservation)
+            deal_index.put_fingerprint(reservationsnummer, fingerprint, deal_id)
+            return action, deal_id
+        finally:
+            with in_flight_changed:
+                in_flight.discard(reservationsnummer)
+                in_flight_changed.notify_all()
+
+    for (fingerprint, reservation), pushed, error in bounded_map(push, changed(), workers):
+        if error:
+            result["failed"] += 1
+            result["errors"].append("{}: {}".format(reservation["Reservationsnummer"], error))
+            continue
+        action, deal_id = pushed
+        result[action] += 1
+
+    return result
@@ -1,9 +1,11 @@
 from flask import Blueprint, render_template
-from requests.models import HTTPError
 
-from project.api_contacts import add_tag_to_contact, get_tag_id, post_contact, get_list_id, subscribe_contact_to_list
+from project.lazy import lazy_import
+from project.onboarding import onboard_contact
 from project.api_deals import post_deal, put_deal
 
+requests = lazy_import('requests')
+
 frontend = Blueprint('frontend', __name__, template_folder='templates')
 
 
@@ -19,30 +21,10 @@ def create_contact():
     contact = {"email": "news@salinamaris.ch", "firstName": "Salina",
                "lastName": "Maris", "Sprache": "Deutsch"}
 
-    # create or update contact
-    response_contact = post_contact(contact)
-    try:
-        response_contact.raise_for_status()
-    except HTTPError:
-        return response_contact.json()
-
-    contact_id = response_contact.json()["contact"]["id"]
-
-    # add tag to contact
-    tag_id = get_tag_id("Wellness")
-    response_add_tag = add_tag_to_contact(tag_id, contact_id)
-    try:
-        response_add_tag.raise_for_status()
-    except HTTPError:
-        return response_add_tag.json()
-
-    # add contact to list
-    list_id = get_list_id("Marketing")
-    response_subscription = subscribe_contact_to_list(contact_id, list_id)
-    try:
-        response_subscription.raise_for_status()
-    except HTTPError:
-        return response_subscription.json()
+    # create or update contact, add tag and subscribe to list
+    result = onboard_contact(contact, tags=["Wellness"], lists=["Marketing"])
+    if result["errors"]:
+        return {"errors": result["errors"]}
 
     return {"success": "contact created"}, 201
 
@@ -55,7 +37,7 @@ def create_deal():
     response_deal = post_deal(deal)
     try:
         response_deal.raise_for_status()
-    except HTTPError:
+    except requests.HTTPError:
         return response_deal.json()
 
     return {"success": "deal created"}, 201
@@ -69,7 +51,7 @@ def update_deal():
     response_deal = put_deal(318482, deal, email="news@salinamaris.ch")
     try:
         response_deal.raise_for_status()
-    except HTTPError:
+    except requests.HTTPError:
         return response_deal.json()
 
     return {"success": "deal updated"}, 200
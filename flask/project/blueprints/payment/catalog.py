@@ -0,0 +1,86 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+from config import Config
+
+
+class Catalog(object):
+    """Active vouchers of gutscheine.json, kept in memory
+
+    The file is loaded once per process and reloaded only if its mtime
+    changed, the mtime is checked at most every `check_interval` seconds.
+    """
+
+    def __init__(self, path: str, check_interval: float = 2):
+        self._path = path
+        self.check_interval = check_interval
+        self._checked_at = None
+        self._mtime = None
+        self._active = []
+        self._by_id = {}
+        self._by_category = {}
+        self._digest = None
+        self._lock = threading.Lock()
+
+    def _load(self, mtime):
+        with open(self._path, 'rb') as f:
+            content = f.read()
+        angebote = json.loads(content)
+
+        active = [a for a in angebote if a['active']]
+        by_category = {}
+        for a in active:
+            for category in a.get('categories', []):
+                by_category.setdefault(category, []).append(a)
+
+        self._active = active
+        self._by_id = {a['id']: a for a in active}
+        self._by_category = by_category
+        self._digest = hashlib.sha256(content).hexdigest()
+        self._mtime = mtime
+
+    def _check(self):
+        """Reload the file if it changed since it was loaded"""
+        now = time.monotonic()
+        if self._checked_at is not None and now - self._checked_at < self.check_interval:
+            return
+        with self._lock:
+            mtime = os.stat(self._path).st_mtime_ns
+            if mtime != self._mtime:
+                self._load(mtime)
+            self._checked_at = now
+
+    @property
+    def active(self):
+        """list of all active vouchers in the order of the file"""
+        self._check()
+        return self._active
+
+    @property
+    def by_id(self):
+        """dict voucher id -> voucher"""
+        self._check()
+        return self._by_id
+
+    @property
+    def by_category(self):
+        """dict category -> list of vouchers"""
+        self._check()
+        return self._by_category
+
+    @property
+    def digest(self):
+        """sha256 of the file content, changes whenever the catalog changes"""
+        self._check()
+        return self._digest
+
+    def get(self, id: str):
+        """Returns the active voucher with this id or None"""
+        return self.by_id.get(id)
+
+
+catalog = Catalog(os.path.join(os.path.dirname(__file__), 'templates', 'payment', 'gutscheine.json'),
+                  check_interval=Config.CATALOG_CHECK_INTERVAL)
@@ -0,0 +1,147 @@
+from collections import deque
+import json
+import os
+import threading
+import time
+
+from flask import current_app
+
+from config import Config
+
+from project import storage
+from project.deadline import clamp_timeout, deadline
+from project.resilience import guarded
+
+_schema = """
+CREATE TABLE IF NOT EXISTS mail_digest (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    data TEXT NOT NULL,
+    created REAL NOT NULL
+);
+"""
+
+
+def _db():
+    return storage.connect(Config.JOBS_DB, _schema)
+
+
+class MailDispatcher(object):
+    """Sends the order confirmations through one long-lived SendGrid client
+
+    With ORDER_MAIL_TEMPLATE set, customer and internal confirmation are one
+    request with a personalization per recipient, the template gets the
+    flag 'internal' to tell them apart. Otherwise each confirmation uses
+    its own template and request.
+
+    If more than MAIL_DIGEST_THRESHOLD orders arrive within
+    MAIL_DIGEST_WINDOW seconds and MAIL_DIGEST_TEMPLATE is set, internal
+    confirmations are collected and sent as one digest mail instead.
+    """
+
+    def __init__(self):
+        self._client = None
+        self._client_pid = None
+        self._orders = deque()
+        self._lock = threading.Lock()
+
+    def client(self):
+        """the SendGrid client of the current process"""
+        if self._client is None or self._client_pid != os.getpid():
+            # imported on first use, most processes never send mails
+            from sendgrid import SendGridAPIClient
+            self._client = SendGridAPIClient(current_app.config['SENDGRID_API_KEY'],
+                                             host=current_app.config['SENDGRID_HOST'])
+            self._client_pid = os.getpid()
+        return self._client
+
+    def send(self, recipients, template: str):
+        """Sends one mail with a personalization per recipient
+
+        Args:
+          recipients: list of tuples (email address, dynamic template data)
+          template: id of the dynamic template
+        """
+        from sendgrid.helpers.mail import Mail, Personalization, To
+
+        mail = Mail(from_email=current_app.config['SENDER_MAIL'])
+        mail.template_id = template
+        for email, data in recipients:
+            personalization = Personalization()
+            personalization.add_to(To(email))
+            personalization.dynamic_template_data = data
+            mail.add_personalization(personalization)
+
+        with guarded('sendgrid', 'mail/send'):
+            return self.client().client.mail.send.post(
+                request_body=mail.get(),
+                timeout=clamp_timeout(current_app.config['SENDGRID_TIMEOUT']))
+
+    def _high_volume(self):
+        """records an order and checks if the digest threshold is reached"""
+        config = current_app.config
+        if not config['MAIL_DIGEST_TEMPLATE']:
+            return False
+
+        now = time.monotonic()
+        with self._lock:
+            self._orders.append(now)
+            while self._orders and now - self._orders[0] > config['MAIL_DIGEST_WINDOW']:
+                self._orders.popleft()
+            return len(self._orders) > config['MAIL_DIGEST_THRESHOLD']
+
+    @deadline('SENDGRID_BUDGET')
+    def send_order_confirmation(self, customer_email: str, data: dict):
+        """Sends the customer and the internal confirmation of an order
+
+        All mails of the order share SENDGRID_BUDGET seconds.
+        """
+        config = current_app.config
+        customer = (customer_email, dict(data, internal=False))
+        internal = (config['INTERNAL_MAIL'], dict(data, internal=True))
+
+        if self._high_volume():
+            # internal confirmation goes into the next digest
+            self.send([customer], config['CUSTOMER_MAIL_TEMPLATE'])
+            _db().execute("INSERT INTO mail_digest (data, created) VALUES (?, ?)",
+                          (json.dumps(data), time.time()))
+            try:
+                self.flush_digest()
+            except Exception:
+                # the orders stay in the digest, the worker tries again
+                current_app.logger.exception('sending the mail digest failed')
+        elif config['ORDER_MAIL_TEMPLATE']:
+            self.send([customer, internal], config['ORDER_MAIL_TEMPLATE'])
+        else:
+            self.send([internal], config['INTERNAL_MAIL_TEMPLATE'])
+            self.send([customer], config['CUSTOMER_MAIL_TEMPLATE'])
+
+    def flush_digest(self, force: bool = False):
+        """Sends the collected internal confirmations as one mail
+
+        The digest is sent once it holds MAIL_DIGEST_MAX_ITEMS orders or its
+        oldest order waits for MAIL_DIGEST_INTERVAL seconds, or if forced.
+        Returns: number of orders sent
+        """
+        config = current_app.config
+        with storage.transaction(_db(), immediate=True) as db:
+            rows = db.execute("SELECT * FROM mail_digest ORDER BY id").fetchall()
+            due = rows and (force or len(rows) >= config['MAIL_DIGEST_MAX_ITEMS'] or
+                            time.time() - rows[0]['created'] >= config['MAIL_DIGEST_INTERVAL'])
+            if not due:
+                return 0
+            db.execute("DELETE FROM mail_digest WHERE id <= ?", (rows[-1]['id'],))
+
+        orders = [json.loads(r['data']) for r in rows]
+        try:
+            self.send([(config['INTERNAL_MAIL'], {'orders': orders, 'count': len(orders)})],
+                      config['MAIL_DIGEST_TEMPLATE'])
+        except Exception:
+            # keep the orders for the next attempt
+            with storage.transaction(_db()) as db:
+                db.executemany("INSERT INTO mail_digest (data, created) VALUES (?, ?)",
+                               [(r['data'], r['created']) for r in rows])
+            raise
+        return len(orders)
+
+
+dispatcher = MailDispatcher()
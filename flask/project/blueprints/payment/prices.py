@@ -0,0 +1,108 @@
+import hashlib
+import json
+
+from config import Config
+
+from project import storage
+from project.lazy import lazy_import
+
+stripe = lazy_import('stripe')
+
+_schema = """
+CREATE TABLE IF NOT EXISTS prices (
+    voucher_id TEXT PRIMARY KEY,
+    product_id TEXT NOT NULL,
+    price_id TEXT NOT NULL,
+    unit_amount INTEGER NOT NULL,
+    fingerprint TEXT NOT NULL
+);
+"""
+
+
+def _db():
+    return storage.connect(Config.STRIPE_PRICES_DB, _schema)
+
+
+def image_url(angebot):
+    """public url of the voucher's image"""
+    return 'https://salina.maris.ch/static/{}'.format(angebot['image'])
+
+
+def _fingerprint(angebot):
+    """hash of all voucher data which is synced to Stripe"""
+    data = {k: angebot.get(k) for k in ('price', 'title', 'subtitle', 'image')}
+    return hashlib.sha256(json.dumps(data, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def get_price_id(angebot):
+    """Finds the synced Stripe price of a voucher
+
+    Returns: price id or None if the voucher was not synced since it changed
+    """
+    row = _db().execute("SELECT price_id, fingerprint FROM prices WHERE voucher_id = ?",
+                        (angebot['id'],)).fetchone()
+    if row is None or row['fingerprint'] != _fingerprint(angebot):
+        return None
+    return row['price_id']
+
+
+def _product_data(angebot):
+    return {
+        'name': angebot['title'],
+        'description': angebot['subtitle'],
+        'images': [image_url(angebot)],
+        'metadata': {'prod_id': angebot['id']},
+    }
+
+
+def sync_prices(angebote):
+    """Syncs vouchers to persistent Stripe products and prices
+
+    Only vouchers whose price, title, subtitle or image changed since the
+    last sync are sent to Stripe. Prices can't be changed in Stripe, a new
+    price replaces the old one, which is archived. Products of vouchers which
+    are no longer active are archived as well.
+    Args: list of active vouchers
+    Returns: dict with the number of created, updated, unchanged and archived vouchers
+    """
+    # https://stripe.com/docs/api/prices
+    db = _db()
+    result = {'created': 0, 'updated': 0, 'unchanged': 0, 'archived': 0}
+    synced = {row['voucher_id']: row for row in db.execute("SELECT * FROM prices")}
+
+    for angebot in angebote:
+        row = synced.pop(angebot['id'], None)
+        fingerprint = _fingerprint(angebot)
+        unit_amount = angebot['price'] * 100
+
+        if row and row['fingerprint'] == fingerprint:
+            result['unchanged'] += 1
+            continue
+
+        if row is None:
+            product = stripe.Product.create(**_product_data(angebot))
+            product_id, price_id = product['id'], None
+            result['created'] += 1
+        else:
+            stripe.Product.modify(row['product_id'], active=True, **_product_data(angebot))
+            product_id, price_id = row['product_id'], row['price_id']
+            result['updated'] += 1
+
+        if price_id is None or row['unit_amount'] != unit_amount:
+            price = stripe.Price.create(product=product_id, unit_amount=unit_amount,
+                                        currency='chf', metadata={'prod_id': angebot['id']})
+            if price_id:
+                stripe.Price.modify(price_id, active=False)
+            price_id = price['id']
+
+        db.execute(
+            "INSERT OR REPLACE INTO prices (voucher_id, product_id, price_id, unit_amount, fingerprint) VALUES (?, ?, ?, ?, ?)",
+            (angebot['id'], product_id, price_id, unit_amount, fingerprint))
+
+    # vouchers which are no longer active
+    for voucher_id, row in synced.items():
+        stripe.Product.modify(row['product_id'], active=False)
+        db.execute("DELETE FROM prices WHERE voucher_id = ?", (voucher_id,))
+        result['archived'] += 1
+
+    return result
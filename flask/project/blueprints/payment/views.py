@@ -1,25 +1,36 @@
 from flask import Blueprint, render_template, url_for, current_app, request, abort
 
-from sendgrid import SendGridAPIClient
-from sendgrid.helpers.mail import Mail
-
-import stripe
+from concurrent.futures import ThreadPoolExecutor
 import json
 
 payment = Blueprint('payment', __name__,
                     template_folder='templates', url_prefix='/payment')
 
 from project.extensions import csrf
+from project.lazy import lazy_import
+from project import jobs
+from project.blueprints.payment.catalog import catalog
+from project.blueprints.payment.mail import dispatcher
+from project.blueprints.payment.prices import get_price_id, image_url
+from project.page_cache import cached_page
+from project.deadline import DeadlineExceeded, deadline
+from project.metrics import propagate
+from project.resilience import CircuitOpen, StripeHttpClient, guarded
+
+stripe = lazy_import('stripe')
 
 
 @payment.record
 def record_config(setup_state):
     stripe.api_key = setup_state.app.config['STRIPE_SECRET_KEY']
+    stripe.default_http_client = StripeHttpClient(setup_state.app.config['STRIPE_TIMEOUT'])
+    catalog.check_interval = setup_state.app.config['CATALOG_CHECK_INTERVAL']
 
 
 @ payment.route('/products')
+@cached_page(lambda: catalog.digest)
 def products():
-    angebote = read_gutscheine()
+    angebote = catalog.active
     return render_template('payment/products.html', angebote=angebote)
 
 
@@ -34,37 +45,48 @@ def stripe_pay():
 
     try:
         if id:
-            angebot = read_gutscheine()[int(id)]
+            # position in the product list is still accepted for old pages
+            angebot = catalog.get(id) or catalog.active[int(id)]
         else:
             return {'error': 'No Product ID'}, 403
 
-        session = stripe.checkout.Session.create(
-            billing_address_collection='required',
-            payment_method_types=['card'],
-            line_items=[{
+        # reference the synced Stripe price, inline price data only for unsynced vouchers
+        price_id = get_price_id(angebot)
+        if price_id:
+            line_item = {'price': price_id, 'quantity': 1}
+        else:
+            line_item = {
                 'price_data': {
                     'currency': 'chf',
                     'unit_amount': angebot['price'] * 100,
                     'product_data': {
                         'name': angebot["title"],
-                        'images': ['https://salina.maris.ch/static/{}'.format(angebot["image"])],
+                        'images': [image_url(angebot)],
                         'description': angebot["subtitle"],
                         'metadata': {'prod_id': angebot['id']}
                     },
                 },
                 'quantity': 1
+            }
 
-            }],
-            mode='payment',
-            locale='de',
-            success_url=url_for('payment.thanks', _external=True) +
-            '?session_id={CHECKOUT_SESSION_ID}',
-            cancel_url=url_for('payment.products', _external=True),
-        )
+        with guarded('stripe', 'checkout.Session.create'):
+            session = stripe.checkout.Session.create(
+                billing_address_collection='required',
+                payment_method_types=['card'],
+                line_items=[line_item],
+                mode='payment',
+                locale='de',
+                success_url=url_for('payment.thanks', _external=True) +
+                '?session_id={CHECKOUT_SESSION_ID}',
+                cancel_url=url_for('payment.products', _external=True),
+            )
         return {
             'checkout_session_id': session['id'],
             'checkout_public_key': current_app.config['STRIPE_PUBLIC_KEY']
         }
+    except (CircuitOpen, DeadlineExceeded):
+        # answered with 503 and 504 by their error handlers
+        raise
     except Exception as e:
         return {'error': str(e)}, 403
 
@@ -72,16 +94,14 @@ def stripe_pay():
 @payment.route('/stripe_webhook', methods=['POST'])
 @csrf.exempt
 def stripe_webhook():
-    print('WEBHOOK CALLED')
-
     # check content size for huge payload
     if request.content_length > 1024 * 1024:
-        print('REQUEST TOO BIG')
+        current_app.logger.warning('stripe webhook payload too big')
         abort(400)
 
     payload = request.get_data()
     sig_header = request.environ.get('HTTP_STRIPE_SIGNATURE')
-    endpoint_secret = 'whsec_bLSOubNYeVgALEbP8GHmuU9zmVefKAdr'
+    endpoint_secret = current_app.config['STRIPE_WEBHOOK_SECRET']
     event = None
 
     # security, make sure the request is valid and from stripe
@@ -91,66 +111,89 @@ def stripe_webhook():
         )
     except ValueError as e:
         # Invalid payload
-        print('INVALID PAYLOAD')
+        current_app.logger.warning('stripe webhook with invalid payload')
         return {}, 400
     except stripe.error.SignatureVerificationError as e:
         # Invalid signature
-        print('INVALID SIGNATURE')
+        current_app.logger.warning('stripe webhook with invalid signature')
         return {}, 400
 
-    # if it is a completed session, handle order fulfillment
+    # if it is a completed session, queue the order fulfillment for the worker
     if event['type'] == 'checkout.session.completed':
-        gutscheine = read_gutscheine()
-        session = event['data']['object']
+        queued = jobs.enqueue(event['type'], json.loads(payload), key=event['id'])
+        current_app.logger.info('stripe webhook', extra={
+            'event_id': event['id'], 'event_type': event['type'], 'queued': queued})
 
-        # get necessary data for confirmation
-        email_data = parse_checkout_session(session, gutscheine)
+    return {}, 200
 
-        # send confirmation mails
-        sg = SendGridAPIClient(current_app.config['SENDGRID_API_KEY'])
-        try:
-            # internal confirmation
-            send_mail(sg, current_app.config['INTERNAL_MAIL'],
-                      email_data, 'd-95cb04609d3e44beb088e5ec1c1bf093')
-            # customer confirmation
-            send_mail(sg, session['customer_details']['email'],
-                      email_data, 'd-1a92894c9c42498cbd374782cfb87947')
-        except Exception as e:
-            print(str(e))
-            return {}, 400
 
-    return {}, 200
+@jobs.handler('checkout.session.completed')
+def fulfill_checkout(event):
+    """Sends the confirmation mails of a completed checkout session
 
+    Runs in the worker process, exceptions make the job retry later.
+    """
+    session = event['data']['object']
 
-def read_gutscheine():
-    filename = current_app.root_path + \
-        '/blueprints/payment/templates/payment/gutscheine.json'
-    with open(filename) as f:
-        angebote = json.load(f)
+    # get necessary data for confirmation
+    email_data = parse_checkout_session(session, catalog.by_id)
 
-    return [a for a in angebote if a['active']]
+    # send customer and internal confirmation
+    dispatcher.send_order_confirmation(
+        session['customer_details']['email'], email_data)
 
 
-def send_mail(client, to, data, template):
-    mail = Mail(from_email=current_app.config['SENDER_MAIL'], to_emails=to)
-    mail.dynamic_template_data = data
-    mail.template_id = template
-    response = client.send(mail)
-    return response
+def _retrieve_checkout_session(session_id):
+    """Retrieves a checkout session with all data needed for the confirmation
 
+    Line items with their products and the payment intent with its charges
+    are expanded, so usually this is the only request to Stripe. Line items
+    beyond the expanded first page and products which were not expanded
+    are fetched concurrently.
+    Returns: tuple (session, line items, payment intent)
+    """
+    with guarded('stripe', 'checkout.Session.retrieve'):
+        session = stripe.checkout.Session.retrieve(
+            session_id,
+            expand=['line_items', 'line_items.data.price.product', 'payment_intent'])
 
-def parse_checkout_session(session, all_products):
+    # more line items than fit on the expanded page, fetch the rest
+    line_items = list(session['line_items']['data'])
+    if session['line_items']['has_more']:
+        with guarded('stripe', 'checkout.Session.list_line_items'):
+            more = stripe.checkout.Session.list_line_items(
+                session_id, starting_after=line_items[-1]['id'], limit=100,
+                expand=['data.price.product'])
+            line_items.extend(more.auto_paging_iter())
+
+    # fetch products which could not be expanded all at once
+    missing = [item['price'] for item in line_items
+               if isinstance(item['price']['product'], str)]
+    if missing:
+        with ThreadPoolExecutor(max_workers=min(len(missing), 8)) as executor:
+            products = executor.map(
+                propagate(_retrieve_product), missing)
+            for price, product in zip(missing, products):
+                price['product'] = product
+
+    return session, line_items, session['payment_intent']
+
+
+def _retrieve_product(price):
+    with guarded('stripe', 'Product.retrieve'):
+        return stripe.Product.retrieve(price['product'])
+
+
+# all Stripe requests for one confirmation share a budget
+@deadline('STRIPE_BUDGET')
+def parse_checkout_session(session, products_by_id):
     # get/create necessary data
     parsed_data = {}
-    currency = session['currency'].upper()
 
-    # retrieve purchased line items
-    line_items = stripe.checkout.Session.list_line_items(
-        session['id'], limit=1)
-
-    # retrieve payment intent with customer and payment data
-    payment_intent = stripe.PaymentIntent.retrieve(
-        session['payment_intent'])
+    # retrieve session with purchased line items, products and payment intent at once
+    session, line_items, payment_intent = _retrieve_checkout_session(
+        session['id'])
+    currency = session['currency'].upper()
 
     # get payment data
     try:
@@ -162,25 +205,26 @@ def parse_checkout_session(session, all_products):
             'payment_description': "**** **** **** {}".format(card['last4'])
         }
     except:
-        parsed_data['payment_info']['payment_description'] = "Credit Card"
+        parsed_data['payment_info'] = {'payment_description': "Credit Card"}
 
     # get paid amount data
     parsed_data['payment_info']['total'] = '{} {:.2f}'.format(
         currency, session['amount_total'] / 100)
     parsed_data['payment_info']['taxes'] = '{} {:.2f}'.format(currency, (session['amount_total'] / 100) -
                                                               (session['amount_total'] / 107.7))
-    parsed_data['payment_info']['stripe_reference'] = session['payment_intent']
+    # sessions without payment, e.g. with a 100% discount, have no payment intent
+    parsed_data['payment_info']['stripe_reference'] = payment_intent['id'] if payment_intent else None
 
     # get relevant product info
     parsed_data['items'] = []
-    for item in line_items['data']:
+    for item in line_items:
         try:
-            product = stripe.Product.retrieve(item['price']['product'])
+            product = item['price']['product']
             item_dict = {
                 'price': '{} {:.2f}'.format(item['currency'].upper(), item['amount_total'] / 100),
                 'quantity': item['quantity'],
                 'name': item['description'],
-                'services': next((g for g in all_products if g['id'] == product['metadata']['prod_id']))['details']['services']
+                'services': products_by_id[product['metadata']['prod_id']]['details']['services']
             }
         except:
             item_dict = {'name': item['description']}
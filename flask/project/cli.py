@@ -1,8 +1,157 @@
-from project import app
+from flask import current_app
+from flask.cli import AppGroup, with_appcontext
 import os
 import click
 
 
+def init_app(app):
+    """Adds the commands to the flask CLI of the app"""
+    for command in (serve, worker, static_group, stripe_group, contacts, deals):
+        app.cli.add_command(command)
+
+
+@click.command('serve')
+@click.option('--bind', help='Address to listen on, defaults to SERVE_BIND.')
+@click.option('--workers', type=int, help='Worker processes, defaults to SERVE_WORKERS.')
+@click.option('--threads', type=int, help='Threads per worker, defaults to SERVE_THREADS.')
+@with_appcontext
+def serve(bind, workers, threads):
+    """Serve the app with multiple workers in production."""
+    from project import serve
+    app = current_app._get_current_object()
+    if app.debug:
+        click.echo('warning: serving with debug enabled', err=True)
+    serve.run(app, bind=bind, workers=workers, threads=threads)
+
+
+@click.command('worker')
+@click.option('--poll-interval', type=float,
+              help='Seconds to wait if no job is due, defaults to JOBS_POLL_INTERVAL.')
+@click.option('--burst', is_flag=True, help='Exit as soon as no job is due.')
+@with_appcontext
+def worker(poll_interval, burst):
+    """Process queued jobs like the order fulfillment."""
+    import signal
+    from project import jobs
+
+    # finish the current job on SIGTERM/SIGINT, then exit
+    stopping = []
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(sig, lambda *args: stopping.append(True))
+
+    from project import ac_mirror
+    from project.blueprints.payment.mail import dispatcher
+
+    def on_idle():
+        dispatcher.flush_digest()
+        # keeps the tags and lists current for the web processes
+        ac_mirror.refresh_stale_mirrors()
+        # done jobs hold customer data of the orders
+        jobs.purge()
+
+    if poll_interval is None:
+        poll_interval = current_app.config['JOBS_POLL_INTERVAL']
+    click.echo('worker started')
+    jobs.run_worker(poll_interval, burst=burst, should_stop=lambda: stopping,
+                    logger=current_app.logger, on_idle=on_idle)
+    # don't leave internal confirmations behind
+    dispatcher.flush_digest(force=True)
+
+
+@click.group('static', cls=AppGroup)
+def static_group():
+    """Static asset commands."""
+    pass
+
+
+@static_group.command('build')
+def build_static():
+    """Build fingerprinted, precompressed bundles and their manifest."""
+    from project import static_build
+    manifest = static_build.build(current_app._get_current_object())
+    for name, entry in sorted(manifest.items()):
+        click.echo('{}: {} ({})'.format(name, entry['file'], ', '.join(entry['encodings'])))
+
+
+@click.group('stripe', cls=AppGroup)
+def stripe_group():
+    """Stripe commands."""
+    pass
+
+
+@stripe_group.command('sync-prices')
+def sync_prices():
+    """Sync all active vouchers to Stripe products and prices."""
+    from project.blueprints.payment.catalog import catalog
+    from project.blueprints.payment.prices import sync_prices
+    result = sync_prices(catalog.active)
+    click.echo('{created} created, {updated} updated, {unchanged} unchanged, '
+               '{archived} archived'.format(**result))
+
+
+@click.group(cls=AppGroup)
+def contacts():
+    """ActiveCampaign contact commands."""
+    pass
+
+
+@contacts.command('import')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--tag', 'tags', multiple=True, help='Tag added to every contact.')
+@click.option('--list', 'lists', multiple=True, help='List every contact is subscribed to.')
+@click.option('--chunk-size', default=250, show_default=True, help='Contacts per request.')
+@click.option('--workers', default=4, show_default=True, help='Concurrent requests.')
+def import_contacts(path, tags, lists, chunk_size, workers):
+    """Import contacts from a CSV or JSON lines file."""
+    from project.api_contacts import bulk_import_contacts
+    from project.streaming import iter_records
+    result = bulk_import_contacts(iter_records(path), tags=tags, lists=lists,
+                                  chunk_size=chunk_size, workers=workers)
+    for error in result['errors']:
+        click.echo(error, err=True)
+    if result['unknown_fields']:
+        click.echo('unknown fields, not imported: {}'.format(
+            ', '.join(result['unknown_fields'])), err=True)
+    click.echo('{} contacts imported, {} failed'.format(
+        result['imported'], result['failed']))
+
+
+@click.group(cls=AppGroup)
+def deals():
+    """ActiveCampaign deal commands."""
+    pass
+
+
+@deals.command('sync-index')
+def sync_index():
+    """Index the Reservationsnummern of all deals updated since the last sync."""
+    from project.api_deals import sync_deal_index
+    count = sync_deal_index()
+    click.echo('{} deals indexed'.format(count))
+
+
+@deals.command('sync')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--workers', default=4, show_default=True, help='Concurrent requests.')
+def sync_deals(path, workers):
+    """Sync reservations from a CSV or JSON lines export to AC deals."""
+    import time
+    from project.api_deals import sync_reservations
+    from project.streaming import iter_records
+    start = time.perf_counter()
+    result = sync_reservations(iter_records(path), workers=workers)
+    seconds = time.perf_counter() - start
+    for error in result['errors']:
+        click.echo(error, err=True)
+    if result['unknown_fields']:
+        click.echo('unknown fields, not imported: {}'.format(
+            ', '.join(result['unknown_fields'])), err=True)
+    total = sum(result[k] for k in ('created', 'updated', 'unchanged', 'failed'))
+    click.echo('{} reservations in {:.1f}s ({:.1f}/s): {created} created, {updated} updated, '
+               '{unchanged} unchanged, {failed} failed'.format(
+                   total, seconds, total / seconds if seconds else 0, **result))
+
+
 # @app.cli.group()
 # def translate():
 #     """Translation and localization commands."""
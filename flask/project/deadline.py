@@ -0,0 +1,98 @@
+from contextlib import contextmanager
+import contextvars
+import time
+
+from flask import current_app, has_app_context, jsonify, request
+
+from config import Config
+
+# monotonic time by which the current request has to be answered
+_deadline = contextvars.ContextVar('deadline', default=None)
+
+
+class DeadlineExceeded(TimeoutError):
+    """The time left for the current request is used up"""
+
+
+@contextmanager
+def deadline(seconds):
+    """Answer the enclosed request or job within seconds
+
+    The deadline is a context variable, threads started through
+    metrics.propagate share it. Nested deadlines can only shorten it.
+
+    Args:
+      seconds: number of seconds or the name of the setting holding them,
+        e.g. 'AC_BUDGET', read from the config of the current app on entry
+    """
+    if isinstance(seconds, str):
+        seconds = current_app.config[seconds] if has_app_context() else getattr(Config, seconds)
+    token = _set(seconds)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def _set(seconds: float):
+    end = time.monotonic() + seconds
+    current = _deadline.get()
+    return _deadline.set(end if current is None else min(end, current))
+
+
+def remaining():
+    """seconds left until the deadline, None if there is none"""
+    end = _deadline.get()
+    if end is None:
+        return None
+    return end - time.monotonic()
+
+
+def expired():
+    """True if the deadline has passed"""
+    left = remaining()
+    return left is not None and left <= 0
+
+
+def clamp_timeout(timeout):
+    """Shortens a requests timeout, a number or (connect, read), to the deadline
+
+    Raises: DeadlineExceeded if there is no time left
+    """
+    left = remaining()
+    if left is None:
+        return timeout
+    if left <= 0:
+        raise DeadlineExceeded()
+    if isinstance(timeout, tuple):
+        return tuple(min(t, left) for t in timeout)
+    return min(timeout, left)
+
+
+def init_app(app):
+    """Gives every request SERVE_REQUEST_TIMEOUT seconds to be answered
+
+    The Stripe webhook gets SERVE_WEBHOOK_TIMEOUT instead, Stripe gives up
+    waiting for our answer much earlier than a browser. Upstream calls
+    running out of time are answered with 504.
+    """
+    timeouts = {'payment.stripe_webhook': app.config['SERVE_WEBHOOK_TIMEOUT']}
+
+    @app.before_request
+    def start_deadline():
+        seconds = timeouts.get(request.endpoint, app.config['SERVE_REQUEST_TIMEOUT'])
+        request.environ['deadline.token'] = _set(seconds)
+
+    @app.teardown_request
+    def end_deadline(exc):
+        token = request.environ.pop('deadline.token', None)
+        if token is not None:
+            try:
+                _deadline.reset(token)
+            except ValueError:
+                # teardown in another context, nothing to clean up
+                pass
+
+    @app.errorhandler(DeadlineExceeded)
+    def deadline_exceeded(e):
+        return jsonify(error='upstream service too slow'), 504
@@ -0,0 +1,113 @@
+from datetime import datetime, timezone
+
+from config import Config
+
+from project import storage
+from project.ac_limiter import BATCH, priority
+from project.ac_paging import iter_pages
+
+_schema = """
+CREATE TABLE IF NOT EXISTS deals (
+    reservationsnummer INTEGER PRIMARY KEY,
+    deal_id TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS synced (
+    reservationsnummer INTEGER PRIMARY KEY,
+    fingerprint TEXT NOT NULL,
+    deal_id TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+def _db():
+    return storage.connect(Config.AC_DEAL_INDEX, _schema)
+
+
+def get(reservationsnummer: int):
+    """Looks up the deal id of a Reservationsnummer in the local index
+
+    Returns: deal id or None if the Reservationsnummer is not indexed
+    """
+    row = _db().execute(
+        "SELECT deal_id FROM deals WHERE reservationsnummer = ?",
+        (int(reservationsnummer),)).fetchone()
+    return row["deal_id"] if row else None
+
+
+def put(reservationsnummer: int, deal_id):
+    """Stores the deal id of a Reservationsnummer"""
+    _db().execute(
+        "INSERT OR REPLACE INTO deals (reservationsnummer, deal_id) VALUES (?, ?)",
+        (int(reservationsnummer), str(deal_id)))
+
+
+def remove(reservationsnummer: int):
+    """Drops a Reservationsnummer, e.g. if its deal was deleted in AC"""
+    _db().execute("DELETE FROM deals WHERE reservationsnummer = ?",
+                  (int(reservationsnummer),))
+
+
+def get_fingerprint(reservationsnummer: int):
+    """Fingerprint of the reservation data last synced to AC, None if never synced"""
+    row = _db().execute(
+        "SELECT fingerprint FROM synced WHERE reservationsnummer = ?",
+        (int(reservationsnummer),)).fetchone()
+    return row["fingerprint"] if row else None
+
+
+def put_fingerprint(reservationsnummer: int, fingerprint: str, deal_id):
+    """Remembers the reservation data synced to the deal"""
+    _db().execute(
+        "INSERT OR REPLACE INTO synced (reservationsnummer, fingerprint, deal_id) VALUES (?, ?, ?)",
+        (int(reservationsnummer), fingerprint, str(deal_id)))
+
+
+def _get_meta(key: str):
+    row = _db().execute("SELECT value FROM meta WHERE key = ?",
+                        (key,)).fetchone()
+    return row["value"] if row else None
+
+
+def _set_meta(key: str, value: str):
+    _db().execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                  (key, value))
+
+
+def sync(field_id, page_size: int = 100):
+    """Adds all deals updated since the last sync to the index
+
+    Args:
+      field_id: id of the custom deal field 'Reservationsnummer'
+      page_size: number of deals requested per page
+    Returns: number of indexed Reservationsnummern
+    """
+    # https://developers.activecampaign.com/reference#list-all-deals
+
+    # remember the start time, deals updated during the sync are picked up next time
+    started = datetime.now(timezone.utc).replace(microsecond=0).isoformat()
+
+    search_params = {"include": "dealCustomFieldData"}
+    last_sync = _get_meta("last_sync")
+    if last_sync:
+        search_params["filters[updated_after]"] = last_sync
+
+    count = 0
+    # the sync yields to interactive requests
+    with priority(BATCH):
+        for page in iter_pages("deals", "deals", params=search_params, page_size=page_size):
+            rows = [(int(float(f["custom_field_number_value"])), str(f["deal_id"]))
+                    for f in page.get("dealCustomFieldData", [])
+                    if str(f["custom_field_id"]) == str(field_id) and
+                    f.get("custom_field_number_value") is not None]
+            with storage.transaction(_db()) as db:
+                db.executemany(
+                    "INSERT OR REPLACE INTO deals (reservationsnummer, deal_id) VALUES (?, ?)",
+                    rows)
+            count += len(rows)
+
+    _set_meta("last_sync", started)
+    return count
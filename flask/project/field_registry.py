@@ -0,0 +1,97 @@
+import threading
+import time
+
+
+class FieldRegistry(object):
+    """In-process cache mapping AC field titles to their internal ids and back
+
+    The mapping is loaded lazily on first use, reloaded once it is older than
+    `ttl` seconds and reloaded right away if a requested title is unknown.
+
+    Args:
+      loader: callable without arguments returning a dict title -> id
+      ttl: seconds after which the mapping is considered stale
+      miss_interval: minimal seconds between two reloads caused by unknown
+        titles, keeps unknown keys from causing a reload on every call
+    """
+
+    def __init__(self, loader, ttl: float = 300, miss_interval: float = 10):
+        self._loader = loader
+        self._ttl = ttl
+        self._miss_interval = miss_interval
+        self._ids = {}
+        self._names = {}
+        self._loaded_at = None
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+
+    def _is_stale(self):
+        return self._loaded_at is None or \
+            time.monotonic() - self._loaded_at > self._ttl
+
+    def refresh(self):
+        """Reload the mapping from AC"""
+        with self._refresh_lock:
+            self._load()
+
+    def _load(self):
+        ids = self._loader()
+        names = {str(v): k for k, v in ids.items()}
+        with self._lock:
+            self._ids = ids
+            self._names = names
+            self._loaded_at = time.monotonic()
+
+    def invalidate(self):
+        """Drop the mapping, the next lookup reloads it from AC"""
+        with self._lock:
+            self._loaded_at = None
+
+    def _needs_reload(self, missing):
+        """True if stale or if missing() and the last reload is long enough ago"""
+        if self._is_stale():
+            return True
+        return missing() and time.monotonic() - self._loaded_at > self._miss_interval
+
+    def _reload_if_needed(self, missing):
+        """Reloads the mapping once, also if many threads find it stale at once"""
+        if self._needs_reload(missing):
+            with self._refresh_lock:
+                # another thread may just have reloaded the mapping
+                if self._needs_reload(missing):
+                    self._load()
+
+    def _ensure(self, names):
+        """Reload if stale or if any of names is unknown"""
+        self._reload_if_needed(lambda: any(n not in self._ids for n in names))
+
+    def get_id(self, name: str):
+        """Finds the internal id of the specified field.
+
+        Returns: id of field or None if field not found.
+        """
+        self._ensure([name])
+        return self._ids.get(name)
+
+    def get_name(self, id):
+        """Finds the title of the field with the specified id.
+
+        Returns: title of field or None if field not found.
+        """
+        id = str(id)
+        self._ensure_id(id)
+        return self._names.get(id)
+
+    def _ensure_id(self, id):
+        """Reload if stale or if id is unknown"""
+        self._reload_if_needed(lambda: id not in self._names)
+
+    def resolve(self, names):
+        """Finds the internal ids of all specified fields in one pass.
+
+        Returns: dict name -> id, unknown names are mapped to None
+        """
+        names = list(names)
+        self._ensure(names)
+        ids = self._ids
+        return {n: ids.get(n) for n in names}
@@ -0,0 +1,155 @@
+import json
+import time
+import traceback
+
+from config import Config
+
+from project import storage
+
+_schema = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    key TEXT UNIQUE,
+    status TEXT NOT NULL DEFAULT 'queued',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    run_after REAL NOT NULL,
+    locked_at REAL,
+    last_error TEXT,
+    created REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_queued ON jobs (status, run_after);
+"""
+
+# job kind -> function handling the job's payload
+_handlers = {}
+
+
+def _db():
+    return storage.connect(Config.JOBS_DB, _schema)
+
+
+def handler(kind: str):
+    """Registers the decorated function as handler of jobs of this kind"""
+    def decorator(function):
+        _handlers[kind] = function
+        return function
+    return decorator
+
+
+def enqueue(kind: str, payload, key: str = None):
+    """Adds a job to the queue
+
+    Args:
+      kind: selects the handler which processes the job
+      payload: JSON serializable data passed to the handler
+      key: optional unique key, a job with a known key is ignored
+        (e.g. the id of a Stripe event which is delivered twice)
+    Returns: True if the job was added
+    Raises: DeadlineExceeded if the database stays locked past the deadline
+    """
+    now = time.time()
+    # webhooks queue jobs, don't wait for a busy database past their deadline
+    with storage.within_deadline(_db()) as db:
+        cursor = db.execute(
+            "INSERT OR IGNORE INTO jobs (kind, payload, key, run_after, created) VALUES (?, ?, ?, ?, ?)",
+            (kind, json.dumps(payload), key, now, now))
+    return cursor.rowcount == 1
+
+
+def _claim():
+    """Marks the next due job as running and returns it, None if there is none"""
+    now = time.time()
+    with storage.transaction(_db(), immediate=True) as db:
+        # jobs running longer than the lease belong to a crashed worker, this
+        # counts as a failed attempt so a job crashing the worker is given up
+        for lost in db.execute(
+                "SELECT * FROM jobs WHERE status = 'running' AND locked_at < ?",
+                (now - Config.JOBS_LEASE,)).fetchall():
+            _fail(lost, "lease expired, the worker stopped while running the job")
+        job = db.execute(
+            "SELECT * FROM jobs WHERE status = 'queued' AND run_after <= ? ORDER BY run_after LIMIT 1",
+            (now,)).fetchone()
+        if job:
+            db.execute(
+                "UPDATE jobs SET status = 'running', locked_at = ? WHERE id = ?", (now, job["id"]))
+    return job
+
+
+def _complete(job):
+    _db().execute("UPDATE jobs SET status = 'done', last_error = NULL WHERE id = ?",
+                  (job["id"],))
+
+
+def _fail(job, error: str):
+    """Schedules a retry with exponential backoff or gives the job up"""
+    attempts = job["attempts"] + 1
+    if attempts >= Config.JOBS_MAX_ATTEMPTS:
+        status, run_after = 'failed', job["run_after"]
+    else:
+        status = 'queued'
+        run_after = time.time() + Config.JOBS_RETRY_BACKOFF * 2 ** (attempts - 1)
+    _db().execute(
+        "UPDATE jobs SET status = ?, attempts = ?, run_after = ?, last_error = ? WHERE id = ?",
+        (status, attempts, run_after, error, job["id"]))
+    return status
+
+
+def purge():
+    """Deletes the jobs done longer than JOBS_RETENTION seconds ago
+
+    Their payloads, e.g. Stripe events, hold customer data which is not
+    needed once the job is done. Their keys are kept until then, so an
+    event delivered again within the retention is still ignored.
+    Returns: number of deleted jobs
+    """
+    # a done job was last claimed at most JOBS_LEASE before it finished
+    cursor = _db().execute("DELETE FROM jobs WHERE status = 'done' AND locked_at < ?",
+                           (time.time() - Config.JOBS_RETENTION,))
+    return cursor.rowcount
+
+
+def work_one(logger=None):
+    """Processes the next due job
+
+    Returns: False if no job was due
+    """
+    job = _claim()
+    if job is None:
+        return False
+
+    try:
+        _handlers[job["kind"]](json.loads(job["payload"]))
+    except Exception:
+        status = _fail(job, traceback.format_exc())
+        if logger:
+            logger.exception('job {} ({}) failed, {}'.format(
+                job["id"], job["kind"], 'giving up' if status == 'failed' else 'retrying'))
+    else:
+        _complete(job)
+    return True
+
+
+def run_worker(poll_interval: float = 1, burst: bool = False, should_stop=None, logger=None,
+               on_idle=None):
+    """Processes jobs until should_stop returns True
+
+    Args:
+      poll_interval: seconds to wait if no job is due
+      burst: stop as soon as no job is due
+      should_stop: callable checked between jobs
+      logger: logger receiving failed jobs
+      on_idle: callable run whenever no job is due, e.g. to flush buffers
+    """
+    while not (should_stop and should_stop()):
+        if not work_one(logger):
+            if on_idle:
+                try:
+                    on_idle()
+                except Exception:
+                    if logger:
+                        logger.exception('idle task failed')
+            if burst:
+                return
+            time.sleep(poll_interval)
@@ -0,0 +1,28 @@
+import importlib.util
+import sys
+
+
+def lazy_import(name: str):
+    """Returns the module name, executed on first attribute access
+
+    The SDKs take a noticeable part of the start up time and most processes,
+    e.g. CLI commands, never use some of them. Accessing any attribute of the
+    returned module loads it, afterwards it is the normal module.
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+
+def load(name: str):
+    """Imports the module name now, also if it was imported lazily before"""
+    module = importlib.import_module(name)
+    # any attribute access executes a lazy module
+    getattr(module, '__name__')
+    return module
@@ -0,0 +1,140 @@
+from logging.handlers import QueueHandler, QueueListener, WatchedFileHandler
+import atexit
+import copy
+import datetime
+import json
+import logging
+import os
+import queue
+import time
+import uuid
+
+from flask import g, has_request_context, request
+from flask.logging import default_handler
+
+from project.metrics import current_stats
+
+# attributes every LogRecord has, everything else was passed with extra=
+_standard_attributes = set(vars(logging.LogRecord(
+    '', 0, '', 0, '', None, None))) | {'message', 'asctime'}
+
+
+class ContextQueueHandler(QueueHandler):
+    """Hands records to a background thread instead of writing them
+
+    The request id, the request and its upstream calls so far are attached
+    to the record here, in the thread which handles the request.
+    """
+
+    def prepare(self, record):
+        # other handlers of the record must still see it unchanged
+        record = copy.copy(record)
+        if has_request_context():
+            record.request_id = getattr(g, 'request_id', None)
+            record.method = request.method
+            record.path = request.path
+            stats = current_stats()
+            if stats is not None:
+                record.upstream_calls = stats.calls
+                record.upstream_seconds = round(stats.seconds, 4)
+
+        # the listener may not access the request, render everything now
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.msg = record.getMessage()
+        record.args = None
+        record.exc_info = None
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats records as one JSON object per line"""
+
+    def format(self, record):
+        data = {
+            'time': datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc)
+            .isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'module': '{}:{}'.format(record.pathname, record.lineno),
+        }
+        for key, value in vars(record).items():
+            if key not in _standard_attributes and key not in data:
+                data[key] = value
+        if record.exc_info:
+            data['exception'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            data['exception'] = record.exc_text
+        return json.dumps(data, default=str)
+
+
+# the queue handler of the process, app.logger is shared by all apps
+_handler = None
+
+
+def _start_listener(handler, file_handler):
+    """starts a thread writing the records queued by handler to file_handler"""
+    handler.queue = queue.SimpleQueue()
+    listener = QueueListener(handler.queue, file_handler, respect_handler_level=True)
+    listener.start()
+    # write out the queued records on shutdown
+    atexit.register(listener.stop)
+
+
+def init_app(app):
+    """Logs app.logger and its children as JSON through a background thread
+
+    Request threads only put records into a queue, a listener thread writes
+    them to logs/project.log. The web workers and 'flask worker' all append
+    to this file, so it is rotated outside the app, see logrotate.conf, and
+    reopened by every process once it was moved. Every request gets
+    an id (taken from X-Request-ID if present) which is attached to its log
+    records and returned in the response, and one record with its duration
+    and upstream calls.
+    """
+
+    @app.before_request
+    def assign_request_id():
+        g.request_id = request.headers.get('X-Request-ID') or uuid.uuid4().hex
+        g.log_start = time.perf_counter()
+
+    @app.after_request
+    def log_request(response):
+        response.headers['X-Request-ID'] = g.get('request_id', '')
+        if 'log_start' in g and not app.debug:
+            app.logger.info('request finished', extra={
+                'status': response.status_code,
+                'duration': round(time.perf_counter() - g.log_start, 4),
+            })
+        return response
+
+    if app.debug:
+        return
+
+    # request threads shouldn't write to stderr either
+    app.logger.removeHandler(default_handler)
+    app.logger.addHandler(_queue_handler())
+    app.logger.setLevel(logging.INFO)
+
+
+def _queue_handler():
+    """the queue handler of the process, created and started once"""
+    global _handler
+    if _handler is not None:
+        return _handler
+
+    if not os.path.exists('logs'):
+        os.mkdir('logs')
+    # rotating in the app isn't safe with several processes writing the file
+    file_handler = WatchedFileHandler('logs/project.log')
+    file_handler.setFormatter(JsonFormatter())
+    file_handler.setLevel(logging.INFO)
+
+    handler = ContextQueueHandler(queue.SimpleQueue())
+    _start_listener(handler, file_handler)
+    # forked processes, e.g. the workers of 'flask serve', don't inherit the
+    # listener thread and need their own
+    os.register_at_fork(after_in_child=lambda: _start_listener(handler, file_handler))
+    _handler = handler
+    return handler
@@ -0,0 +1,326 @@
+from contextlib import contextmanager
+import atexit
+import contextvars
+import json
+import os
+import re
+import threading
+import time
+import uuid
+
+from flask import Response, request
+
+from project import storage
+
+# upper bounds of the latency histogram buckets in seconds
+_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+# upper bounds of the upstream calls per request histogram buckets
+_call_buckets = (0, 1, 2, 3, 5, 8, 13, 21)
+
+_lock = threading.Lock()
+_histograms = {}  # (name, labels) -> [bucket counts, sum, count]
+_counters = {}  # (name, labels) -> count
+
+_help = {
+    'upstream_request_duration_seconds': 'Latency of outbound calls to AC, Stripe and SendGrid',
+    'upstream_requests_total': 'Outbound calls by service, endpoint and status',
+    'http_request_duration_seconds': 'Latency of inbound requests',
+    'http_requests_total': 'Inbound requests by endpoint and status',
+    'http_request_upstream_calls': 'Outbound calls made per inbound request',
+}
+
+# upstream call statistics of the current inbound request
+_stats = contextvars.ContextVar('upstream_stats', default=None)
+
+# snapshots of the metrics of all processes, see share()
+_schema = """
+CREATE TABLE IF NOT EXISTS snapshots (
+    process TEXT PRIMARY KEY,
+    data TEXT NOT NULL,
+    updated REAL NOT NULL
+);
+"""
+_shared = {'path': None, 'interval': None, 'flushed_at': 0, 'process': uuid.uuid4().hex}
+
+
+class RequestStats(object):
+    """Outbound calls made while handling one inbound request"""
+
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0
+        self.by_service = {}
+        self._lock = threading.Lock()
+
+    def add(self, service: str, seconds: float):
+        with self._lock:
+            self.calls += 1
+            self.seconds += seconds
+            self.by_service[service] = self.by_service.get(service, 0) + 1
+
+
+def current_stats():
+    """RequestStats of the current request or None outside of requests"""
+    return _stats.get()
+
+
+def _labels(**labels):
+    return tuple(sorted(labels.items()))
+
+
+def _observe(name: str, labels: tuple, value: float, buckets=_buckets):
+    with _lock:
+        histogram = _histograms.get((name, labels))
+        if histogram is None:
+            histogram = _histograms[(name, labels)] = [[0] * len(buckets), 0, 0]
+        for i, bound in enumerate(buckets):
+            if value <= bound:
+                histogram[0][i] += 1
+        histogram[1] += value
+        histogram[2] += 1
+
+
+def _inc(name: str, labels: tuple):
+    with _lock:
+        _counters[(name, labels)] = _counters.get((name, labels), 0) + 1
+
+
+def normalize_endpoint(endpoint: str):
+    """replaces ids in an url path, e.g. 'deals/123' -> 'deals/:id'"""
+    return re.sub(r'(?<=/)\d+(?=/|$)', ':id', endpoint.split('?')[0])
+
+
+def observe_upstream(service: str, endpoint: str, status, seconds: float):
+    """Records one outbound call
+
+    Args:
+      service: 'ac', 'stripe' or 'sendgrid'
+      endpoint: called endpoint or operation, ids are replaced
+      status: HTTP status or error name
+      seconds: latency of the call
+    """
+    endpoint = normalize_endpoint(endpoint)
+    _observe('upstream_request_duration_seconds',
+             _labels(service=service, endpoint=endpoint), seconds)
+    _inc('upstream_requests_total',
+         _labels(service=service, endpoint=endpoint, status=str(status)))
+
+    stats = _stats.get()
+    if stats is not None:
+        stats.add(service, seconds)
+    _flush_if_due()
+
+
+@contextmanager
+def timed(service: str, endpoint: str):
+    """Records the enclosed outbound call, e.g. a Stripe or SendGrid call
+
+    The status is 'ok' or the name of the raised exception.
+    """
+    status = 'ok'
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception as err:
+        status = type(err).__name__
+        raise
+    finally:
+        observe_upstream(service, endpoint, status,
+                         time.perf_counter() - start)
+
+
+def propagate(function):
+    """Wraps function to record its calls for the current request
+
+    Use it for functions submitted to thread pools, which otherwise don't
+    know the request they are working for.
+    """
+    context = contextvars.copy_context()
+
+    def wrapper(*args, **kwargs):
+        return context.run(function, *args, **kwargs)
+    return wrapper
+
+
+def _format_labels(labels, **extra):
+    items = list(labels) + sorted(extra.items())
+    if not items:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+                          for k, v in items) + '}'
+
+
+def _dump(histograms, counters):
+    return json.dumps({
+        'histograms': [[n, labels, v] for (n, labels), v in histograms.items()],
+        'counters': [[n, labels, v] for (n, labels), v in counters.items()],
+    })
+
+
+def _snapshot():
+    """the metrics of this process as JSON"""
+    with _lock:
+        return _dump(_histograms, _counters)
+
+
+def _merge(snapshots):
+    """sums snapshots as returned by _snapshot into dicts like _histograms and _counters"""
+    histograms, counters = {}, {}
+    for data in snapshots:
+        data = json.loads(data)
+        for name, labels, (counts, total, count) in data['histograms']:
+            key = (name, tuple(tuple(l) for l in labels))
+            merged = histograms.setdefault(key, [[0] * len(counts), 0, 0])
+            merged[0] = [a + b for a, b in zip(merged[0], counts)]
+            merged[1] += total
+            merged[2] += count
+        for name, labels, value in data['counters']:
+            key = (name, tuple(tuple(l) for l in labels))
+            counters[key] = counters.get(key, 0) + value
+    return histograms, counters
+
+
+def _db():
+    return storage.connect(_shared['path'], _schema)
+
+
+def flush():
+    """Stores the metrics of this process for /metrics of the other processes"""
+    if _shared['path'] is None:
+        return
+    _shared['flushed_at'] = time.monotonic()
+    _db().execute("INSERT OR REPLACE INTO snapshots (process, data, updated) VALUES (?, ?, ?)",
+                  (_shared['process'], _snapshot(), time.time()))
+
+
+def _flush_if_due():
+    if _shared['path'] is not None and \
+            time.monotonic() - _shared['flushed_at'] > _shared['interval']:
+        flush()
+
+
+def _retire():
+    """Adds the metrics of this exiting process to the ones of all exited processes"""
+    if _shared['path'] is None:
+        return
+    with storage.transaction(_db(), immediate=True) as db:
+        row = db.execute("SELECT data FROM snapshots WHERE process = 'retired'").fetchone()
+        snapshots = [_snapshot()] + ([row['data']] if row else [])
+        db.execute("INSERT OR REPLACE INTO snapshots (process, data, updated) VALUES ('retired', ?, ?)",
+                   (_dump(*_merge(snapshots)), time.time()))
+        db.execute("DELETE FROM snapshots WHERE process = ?", (_shared['process'],))
+
+
+def _reset_after_fork():
+    """a forked process starts with empty metrics of its own"""
+    with _lock:
+        _histograms.clear()
+        _counters.clear()
+    _shared['process'] = uuid.uuid4().hex
+    _shared['flushed_at'] = 0
+
+
+def share(path: str, interval: float):
+    """Shares the metrics between all processes using the database at path
+
+    Every process stores its metrics there at most every interval seconds
+    and when it exits, render() sums the metrics of all processes. Counters
+    of exited processes, e.g. web workers replaced after SERVE_MAX_REQUESTS,
+    are kept, so they never go back.
+    """
+    if _shared['path'] is None:
+        atexit.register(_retire)
+        os.register_at_fork(after_in_child=_reset_after_fork)
+    _shared['path'] = path
+    _shared['interval'] = interval
+
+
+def render():
+    """All metrics in the Prometheus text format
+
+    With share() the metrics of all processes are summed, the ones of other
+    running processes are up to the flush interval old.
+    """
+    if _shared['path'] is not None:
+        flush()
+        histograms, counters = _merge(
+            row['data'] for row in _db().execute("SELECT data FROM snapshots"))
+    else:
+        with _lock:
+            histograms = {k: (list(v[0]), v[1], v[2]) for k, v in _histograms.items()}
+            counters = dict(_counters)
+
+    lines = []
+    for name in sorted({k[0] for k in histograms}):
+        lines.append('# HELP {} {}'.format(name, _help.get(name, name)))
+        lines.append('# TYPE {} histogram'.format(name))
+        buckets = _call_buckets if name == 'http_request_upstream_calls' else _buckets
+        for (n, labels), (counts, total, count) in sorted(histograms.items()):
+            if n != name:
+                continue
+            for bound, value in zip(buckets, counts):
+                lines.append('{}_bucket{} {}'.format(
+                    name, _format_labels(labels, le=bound), value))
+            lines.append('{}_bucket{} {}'.format(
+                name, _format_labels(labels, le='+Inf'), count))
+            lines.append('{}_sum{} {}'.format(name, _format_labels(labels), total))
+            lines.append('{}_count{} {}'.format(name, _format_labels(labels), count))
+    for name in sorted({k[0] for k in counters}):
+        lines.append('# HELP {} {}'.format(name, _help.get(name, name)))
+        lines.append('# TYPE {} counter'.format(name))
+        for (n, labels), value in sorted(counters.items()):
+            if n == name:
+                lines.append('{}{} {}'.format(name, _format_labels(labels), value))
+    return '\n'.join(lines) + '\n'
+
+
+def init_app(app):
+    """Measures all requests of app and serves the metrics on /metrics
+
+    Requests slower than SLOW_REQUEST_THRESHOLD seconds are logged as
+    warnings together with their outbound calls. The metrics of all
+    processes, e.g. the web workers and 'flask worker', are summed through
+    METRICS_DB.
+    """
+    share(app.config['METRICS_DB'], app.config['METRICS_FLUSH_INTERVAL'])
+
+    @app.before_request
+    def start_request():
+        request.environ['metrics.start'] = time.perf_counter()
+        request.environ['metrics.token'] = _stats.set(RequestStats())
+
+    @app.after_request
+    def finish_request(response):
+        start = request.environ.get('metrics.start')
+        stats = _stats.get()
+        if start is None or stats is None:
+            return response
+
+        seconds = time.perf_counter() - start
+        endpoint = request.endpoint or 'unknown'
+        _observe('http_request_duration_seconds', _labels(endpoint=endpoint), seconds)
+        _observe('http_request_upstream_calls', _labels(endpoint=endpoint),
+                 stats.calls, buckets=_call_buckets)
+        _inc('http_requests_total', _labels(endpoint=endpoint, status=response.status_code))
+
+        if seconds > app.config['SLOW_REQUEST_THRESHOLD']:
+            app.logger.warning('slow request {} {} took {:.3f}s, {} upstream calls ({}) took {:.3f}s'.format(
+                request.method, request.path, seconds, stats.calls,
+                ', '.join('{} {}'.format(k, v) for k, v in sorted(stats.by_service.items())),
+                stats.seconds))
+        _flush_if_due()
+        return response
+
+    @app.teardown_request
+    def end_request(exc):
+        token = request.environ.pop('metrics.token', None)
+        if token is not None:
+            try:
+                _stats.reset(token)
+            except ValueError:
+                # teardown in another context, nothing to clean up
+                pass
+
+    @app.route('/metrics')
+    def metrics():
+        return Response(render(), mimetype='text/plain; version=0.0.4')
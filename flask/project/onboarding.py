@@ -0,0 +1,89 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from config import Config
+
+from project.deadline import DeadlineExceeded, deadline
+from project.lazy import lazy_import
+from project.metrics import propagate
+from project.resilience import CircuitOpen
+
+from project import ac_mirror
+from project.api_contacts import add_tag_to_contact, post_contact, subscribe_contact_to_list
+
+requests = lazy_import("requests")
+
+_executor = ThreadPoolExecutor(max_workers=Config.ONBOARDING_WORKERS,
+                               thread_name_prefix="onboarding")
+
+
+def _error(response):
+    """error description of a failed AC response"""
+    try:
+        return response.json()
+    except ValueError:
+        return response.text
+
+
+@deadline('AC_BUDGET')
+def onboard_contact(contact: dict, tags: list = [], lists: list = []):
+    """creates or updates a contact, then adds tags and subscribes to lists
+
+    Tag and list names are resolved from the local copy of all tags and
+    lists, all tag and list assignments run concurrently once the contact id
+    is known. All AC requests share AC_BUDGET seconds.
+    Args:
+      contact: flat dictionary with all the information for the contact
+      tags: names of the tags to add to the contact
+      lists: names of the lists to subscribe the contact to
+    Returns: dict with the AC contact, the ids of the assigned tags and lists
+      and a list of errors, which is empty on success
+    """
+    result = {"contact": None, "tags": {}, "lists": {}, "errors": []}
+
+    # resolve names first, unknown names only hit AC to refresh the copy
+    try:
+        tag_names, list_names = ac_mirror.tags.resolve(tags), ac_mirror.lists.resolve(lists)
+    except (CircuitOpen, DeadlineExceeded):
+        # answered with 503 and 504 by their error handlers
+        raise
+    except Exception as err:
+        result["errors"].append({"step": "names", "error": str(err)})
+        return result
+
+    response_contact = post_contact(contact)
+    try:
+        response_contact.raise_for_status()
+    except requests.HTTPError:
+        result["errors"].append({"step": "contact", "error": _error(response_contact)})
+        return result
+    result["contact"] = response_contact.json()["contact"]
+    contact_id = result["contact"]["id"]
+
+    assignments = []
+    for name, id in tag_names.items():
+        if id is None:
+            result["errors"].append({"step": "tag " + name, "error": "unknown tag"})
+        else:
+            assignments.append(("tags", name, id, _executor.submit(
+                propagate(add_tag_to_contact), id, contact_id)))
+    for name, id in list_names.items():
+        if id is None:
+            result["errors"].append({"step": "list " + name, "error": "unknown list"})
+        else:
+            assignments.append(("lists", name, id, _executor.submit(
+                propagate(subscribe_contact_to_list), contact_id, id)))
+
+    for kind, name, id, future in assignments:
+        try:
+            response = future.result()
+            response.raise_for_status()
+        except requests.HTTPError:
+            result["errors"].append({"step": kind[:-1] + " " + name, "error": _error(response)})
+        except (CircuitOpen, DeadlineExceeded):
+            raise
+        except Exception as err:
+            result["errors"].append({"step": kind[:-1] + " " + name, "error": str(err)})
+        else:
+            result[kind][name] = id
+
+    return result
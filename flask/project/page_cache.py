@@ -0,0 +1,55 @@
+from functools import wraps
+import hashlib
+import threading
+
+from flask import current_app, make_response, request
+
+
+def cached_page(content_key, max_age: int = None):
+    """Caches the rendered HTML of a view and serves it with an ETag
+
+    The HTML is rendered again only when content_key() returns a new value,
+    e.g. the hash of the data the page shows. Responses carry a strong ETag
+    and Cache-Control, requests with a matching If-None-Match get a 304.
+    The cache is bypassed in debug mode so template changes show up.
+
+    Args:
+      content_key: callable returning a hashable key of the page's content
+      max_age: seconds browsers and proxies may reuse the page unchecked,
+        defaults to PAGE_CACHE_MAX_AGE
+    """
+    def decorator(view):
+        # (content key, view arguments) -> (etag, html)
+        pages = {}
+        lock = threading.Lock()
+
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if current_app.debug:
+                return view(*args, **kwargs)
+
+            key = (content_key(), tuple(sorted(kwargs.items())))
+            page = pages.get(key)
+            if page is None:
+                html = view(*args, **kwargs)
+                etag = hashlib.sha256(html.encode('utf-8')).hexdigest()
+                page = (etag, html)
+                with lock:
+                    # drop pages of outdated content
+                    for k in [k for k in pages if k[0] != key[0]]:
+                        del pages[k]
+                    pages[key] = page
+
+            etag, html = page
+            if etag in request.if_none_match:
+                response = make_response('', 304)
+            else:
+                response = make_response(html)
+            response.set_etag(etag)
+            response.cache_control.public = True
+            response.cache_control.max_age = current_app.config['PAGE_CACHE_MAX_AGE'] \
+                if max_age is None else max_age
+            return response
+
+        return wrapper
+    return decorator
@@ -0,0 +1,166 @@
+from contextlib import contextmanager
+import threading
+import time
+
+from flask import jsonify
+
+from config import Config
+
+from project.deadline import DeadlineExceeded, clamp_timeout, expired
+from project.metrics import timed
+
+
+class CircuitOpen(Exception):
+    """The service failed repeatedly, calls fail fast until it recovers"""
+
+    def __init__(self, service: str):
+        super().__init__('{} is unavailable'.format(service))
+        self.service = service
+
+
+class CircuitBreaker(object):
+    """Stops calling a service after `threshold` failures in a row
+
+    While open every call fails with CircuitOpen. After `reset_timeout`
+    seconds one trial call is let through, its success closes the circuit
+    again, its failure keeps it open for another `reset_timeout`.
+
+    Args:
+      service: name of the service, e.g. 'ac'
+      threshold: consecutive failures which open the circuit
+      reset_timeout: seconds until a trial call is let through
+    """
+
+    def __init__(self, service: str, threshold: int, reset_timeout: float):
+        self.service = service
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Raises CircuitOpen unless a call may be sent now"""
+        with self._lock:
+            if self._opened_at is None:
+                return
+            if self._trial or time.monotonic() - self._opened_at < self.reset_timeout:
+                raise CircuitOpen(self.service)
+            # half open, this call is the trial
+            self._trial = True
+
+    def record(self, success):
+        """Records the outcome of a call let through by allow()
+
+        success is None if the call says nothing about the health of the
+        service, e.g. because our deadline ran out.
+        """
+        with self._lock:
+            self._trial = False
+            if success is None:
+                return
+            if success:
+                self._failures = 0
+                self._opened_at = None
+                return
+            self._failures += 1
+            if self._opened_at is not None or self._failures >= self.threshold:
+                self._opened_at = time.monotonic()
+
+
+# one breaker per service and process
+breakers = {service: CircuitBreaker(service, Config.BREAKER_THRESHOLD,
+                                    Config.BREAKER_RESET_TIMEOUT)
+            for service in ('ac', 'stripe', 'sendgrid')}
+
+
+def outcome(err):
+    """Success of a call which raised err as expected by CircuitBreaker.record
+
+    Connection problems, timeouts and server errors are failures, client
+    errors are not.
+    """
+    if isinstance(err, DeadlineExceeded):
+        # our own time ran out, that says nothing about the service
+        return None
+    # Stripe errors carry http_status, SendGrid errors status_code
+    status = getattr(err, 'http_status', None) or getattr(err, 'status_code', None)
+    return status is not None and status < 500
+
+
+@contextmanager
+def guarded(service: str, endpoint: str):
+    """Protects the enclosed call to a service by its circuit breaker
+
+    The call is also recorded like with metrics.timed. Use clients whose
+    timeout is shortened to the deadline.
+    Raises: CircuitOpen while the service is unhealthy, DeadlineExceeded
+      if the deadline ran out before or during the call
+    """
+    if expired():
+        raise DeadlineExceeded()
+    breaker = breakers[service]
+    breaker.allow()
+    try:
+        with timed(service, endpoint):
+            yield
+    except Exception as err:
+        if expired():
+            # the call timed out with the deadline
+            breaker.record(None)
+            raise DeadlineExceeded() from err
+        breaker.record(outcome(err))
+        raise
+    breaker.record(True)
+
+
+class StripeHttpClient(object):
+    """Stripe http client which shortens its timeout to the current deadline
+
+    The client of the stripe package is created on first use, so setting
+    this as stripe.default_http_client doesn't import stripe yet.
+    """
+
+    def __init__(self, timeout):
+        self.timeout = timeout
+        self._client = None
+        self._lock = threading.Lock()
+
+    def _create(self):
+        from stripe.http_client import RequestsClient
+
+        class DeadlineRequestsClient(RequestsClient):
+
+            @property
+            def _timeout(self):
+                try:
+                    return clamp_timeout(self._base_timeout)
+                except DeadlineExceeded:
+                    # time out right away, guarded() raises DeadlineExceeded
+                    return 0.001
+
+            @_timeout.setter
+            def _timeout(self, value):
+                self._base_timeout = value
+
+        return DeadlineRequestsClient(timeout=self.timeout)
+
+    def __getattr__(self, name):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = self._create()
+        return getattr(self._client, name)
+
+
+def init_app(app):
+    """Configures the breakers and answers calls to services with an open circuit with 503"""
+    for breaker in breakers.values():
+        breaker.threshold = app.config['BREAKER_THRESHOLD']
+        breaker.reset_timeout = app.config['BREAKER_RESET_TIMEOUT']
+
+    @app.errorhandler(CircuitOpen)
+    def circuit_open(e):
+        app.logger.warning('{} skipped, the circuit is open'.format(e.service))
+        return jsonify(error=str(e)), 503
@@ -0,0 +1,72 @@
+import sqlite3
+
+from flask import jsonify
+
+from project import lazy, storage
+
+# SDKs imported once before the workers are forked, so they share the memory
+_preloaded = ('requests', 'stripe', 'sendgrid')
+
+
+def options(config, **overrides):
+    """gunicorn settings from the SERVE_* config, overrides which aren't None win"""
+    settings = {
+        'bind': config['SERVE_BIND'],
+        'workers': config['SERVE_WORKERS'],
+        # the views mostly wait for AC and Stripe, threads are cheaper than processes
+        'worker_class': 'gthread',
+        'threads': config['SERVE_THREADS'],
+        'preload_app': True,
+        'timeout': config['SERVE_TIMEOUT'],
+        'graceful_timeout': config['SERVE_GRACEFUL_TIMEOUT'],
+        'keepalive': config['SERVE_KEEPALIVE'],
+        'max_requests': config['SERVE_MAX_REQUESTS'],
+        'max_requests_jitter': config['SERVE_MAX_REQUESTS_JITTER'],
+        # requests are logged by the app
+        'accesslog': None,
+        'errorlog': '-',
+    }
+    settings.update((k, v) for k, v in overrides.items() if v is not None)
+    return settings
+
+
+def run(app, **overrides):
+    """Serves app with gunicorn until it is stopped
+
+    The app is loaded before forking the workers. Each worker serves
+    SERVE_THREADS requests at once and is replaced after about
+    SERVE_MAX_REQUESTS requests; on SIGTERM or SIGHUP running requests get
+    SERVE_GRACEFUL_TIMEOUT seconds to finish.
+    """
+    from gunicorn.app.base import BaseApplication
+
+    settings = options(app.config, **overrides)
+
+    class Server(BaseApplication):
+
+        def load_config(self):
+            for key, value in settings.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            for name in _preloaded:
+                lazy.load(name)
+            return app
+
+    Server().run()
+
+
+def init_app(app):
+    """Adds /healthz for load balancers and process managers
+
+    It only checks the local job database, an unhealthy AC or Stripe
+    mustn't take our workers out of rotation.
+    """
+
+    @app.route('/healthz')
+    def healthz():
+        try:
+            storage.connect(app.config['JOBS_DB']).execute('SELECT 1')
+        except sqlite3.Error as err:
+            return jsonify(status='error', error=str(err)), 503
+        return jsonify(status='ok')
@@ -0,0 +1,105 @@
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+
+import brotli
+from flask import abort, request, send_file, url_for
+
+from project.bundles import bundles
+from project.extensions import assets
+
+# far future caching, the file names change with the content
+_max_age = 31536000
+_immutable = 'public, max-age={}, immutable'.format(_max_age)
+
+
+def _dist_folder(app):
+    return os.path.join(app.static_folder, 'dist')
+
+
+def _manifest_path(app):
+    return os.path.join(_dist_folder(app), 'manifest.json')
+
+
+def build(app):
+    """Builds all registered bundles into content hashed, precompressed files
+
+    Every bundle is written to static/dist as e.g. styles.<hash>.css next
+    to a gzip and a brotli compressed copy. manifest.json maps the bundle
+    names to these files.
+    Returns: the manifest
+    """
+    dist = _dist_folder(app)
+    os.makedirs(dist, exist_ok=True)
+    manifest = {}
+
+    with app.app_context():
+        for name in bundles:
+            bundle = assets[name]
+            # run the filters of the bundle, then read its output
+            bundle.build(force=True)
+            with open(os.path.join(app.static_folder, bundle.output), 'rb') as f:
+                content = f.read()
+
+            base, ext = os.path.splitext(os.path.basename(bundle.output))
+            digest = hashlib.sha256(content).hexdigest()[:12]
+            filename = '{}.{}{}'.format(base, digest, ext)
+            path = os.path.join(dist, filename)
+
+            with open(path, 'wb') as f:
+                f.write(content)
+            with open(path + '.br', 'wb') as f:
+                f.write(brotli.compress(content))
+            with open(path + '.gz', 'wb') as f:
+                f.write(gzip.compress(content, compresslevel=9, mtime=0))
+            encodings = ['br', 'gzip']
+
+            manifest[name] = {'file': filename, 'encodings': encodings}
+
+    with open(_manifest_path(app), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return manifest
+
+
+def init_app(app):
+    """Serves the built bundles, falls back to Flask-Assets if there are none
+
+    Templates get the global asset_url(bundle name). With a manifest from
+    'flask static build' it points to the fingerprinted file, which is served
+    precompressed with immutable cache headers; Flask-Assets then doesn't
+    check the bundles on requests anymore.
+    """
+    manifest = {}
+    if os.path.exists(_manifest_path(app)):
+        with open(_manifest_path(app)) as f:
+            manifest = json.load(f)
+        app.config['ASSETS_AUTO_BUILD'] = False
+    files = {entry['file']: entry['encodings'] for entry in manifest.values()}
+    dist = _dist_folder(app)
+
+    @app.template_global()
+    def asset_url(name: str):
+        """url of the bundle with this name"""
+        if name in manifest:
+            return url_for('built_asset', filename=manifest[name]['file'])
+        return assets[name].urls()[0]
+
+    @app.route('/assets/<filename>')
+    def built_asset(filename):
+        if filename not in files:
+            abort(404)
+        path = os.path.join(dist, filename)
+        mimetype = mimetypes.guess_type(filename)[0]
+
+        accepted = request.accept_encodings
+        encoding = next((e for e in files[filename] if e in accepted), None)
+        suffix = {'br': '.br', 'gzip': '.gz'}.get(encoding, '')
+        response = send_file(path + suffix, mimetype=mimetype, conditional=True,
+                             cache_timeout=_max_age)
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        response.headers['Vary'] = 'Accept-Encoding'
+        response.headers['Cache-Control'] = _immutable
+        return response
@@ -0,0 +1,84 @@
+from contextlib import contextmanager
+import os
+import sqlite3
+import threading
+
+from project.deadline import DeadlineExceeded, expired, remaining
+
+_local = threading.local()
+# seconds to wait for the lock of another connection
+_busy_timeout = 30
+
+
+def connect(path: str, schema: str = None):
+    """Returns the sqlite connection to path for the current thread
+
+    Connections are cached per thread and process, the database file and
+    its directory are created on first use. Every schema is executed once
+    per connection, several stores may share a database file (use
+    CREATE ... IF NOT EXISTS statements).
+    """
+    connections = getattr(_local, "connections", None)
+    if connections is None or _local.pid != os.getpid():
+        connections = _local.connections = {}
+        _local.schemas = set()
+        _local.pid = os.getpid()
+
+    db = connections.get(path)
+    if db is None:
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+
+        # autocommit mode, use 'with db:' for transactions
+        db = sqlite3.connect(path, timeout=_busy_timeout, isolation_level=None)
+        db.row_factory = sqlite3.Row
+        # WAL allows concurrent readers while one process writes
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        connections[path] = db
+    if schema and (path, schema) not in _local.schemas:
+        db.executescript(schema)
+        _local.schemas.add((path, schema))
+    return db
+
+
+@contextmanager
+def transaction(db, immediate: bool = False):
+    """Runs the enclosed statements in one transaction
+
+    immediate takes the write lock right away, use it for read-modify-write
+    transactions which compete with other processes.
+    """
+    db.execute("BEGIN IMMEDIATE" if immediate else "BEGIN")
+    try:
+        yield db
+    except BaseException:
+        db.execute("ROLLBACK")
+        raise
+    db.execute("COMMIT")
+
+
+@contextmanager
+def within_deadline(db):
+    """Waits for locks of other connections at most until the current deadline
+
+    Use it for statements in requests which must be answered in time, e.g.
+    webhooks, instead of waiting up to 30 seconds for a busy database.
+    Raises: DeadlineExceeded if the deadline passed while waiting
+    """
+    left = remaining()
+    if left is None:
+        yield db
+        return
+    if left <= 0:
+        raise DeadlineExceeded()
+    db.execute("PRAGMA busy_timeout = {}".format(int(min(left, _busy_timeout) * 1000)))
+    try:
+        yield db
+    except sqlite3.OperationalError as err:
+        if expired():
+            raise DeadlineExceeded() from err
+        raise
+    finally:
+        db.execute("PRAGMA busy_timeout = {}".format(_busy_timeout * 1000))
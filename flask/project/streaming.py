@@ -0,0 +1,58 @@
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from itertools import islice
+import csv
+import json
+
+
+def iter_records(path: str):
+    """Yields the records of a CSV or JSON lines file one by one
+
+    The format is chosen by the file extension: '.csv' files are read with
+    the header row as keys, empty cells are left out. All other files are
+    read as JSON lines, one object per line.
+    """
+    with open(path, newline='', encoding='utf-8') as f:
+        if path.lower().endswith('.csv'):
+            for row in csv.DictReader(f):
+                yield {k: v for k, v in row.items() if k and v not in ('', None)}
+        else:
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+
+
+def chunked(iterable, size: int):
+    """Yields lists of up to size items of iterable"""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def bounded_map(function, iterable, workers: int):
+    """Applies function to all items of iterable using a pool of threads
+
+    At most 2 * workers items are taken from iterable at a time, so it can
+    be a lazy stream of any length.
+    Yields: tuples (item, result, error) in the order of completion, error
+      is None on success and the raised exception otherwise
+    """
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = {}
+
+        def completed(futures):
+            for future in futures:
+                item = pending.pop(future)
+                error = future.exception()
+                yield item, None if error else future.result(), error
+
+        for item in iterable:
+            pending[executor.submit(function, item)] = item
+            if len(pending) >= 2 * workers:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                yield from completed(done)
+
+        yield from completed(list(pending))
@@ -0,0 +1,13 @@
+import os
+import sys
+import tempfile
+
+# never touch the databases of a real installation
+os.environ['DATA_DIR'] = tempfile.mkdtemp(prefix='tests-')
+
+try:
+    import config  # noqa: F401
+except ImportError:
+    # no private config, use the public template
+    import config_public
+    sys.modules['config'] = config_public
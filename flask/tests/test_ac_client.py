@@ -0,0 +1,55 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import threading
+import time
+
+import pytest
+
+from project import ac_client
+
+
+@pytest.fixture
+def ac(monkeypatch):
+    """local AC answering with the queued (status, headers), then 200"""
+    answers = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            status, headers = answers.pop(0) if answers else (200, {})
+            self.send_response(status)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header('Content-Length', '2')
+            self.end_headers()
+            self.wfile.write(b'{}')
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setattr(ac_client, '_url', 'http://127.0.0.1:{}/'.format(server.server_port))
+    yield answers
+    server.shutdown()
+
+
+def test_throttled_request_is_sent_again_after_retry_after(ac):
+    ac.append((429, {'Retry-After': '1'}))
+    start = time.monotonic()
+    response = ac_client.get_response('contacts')
+    assert response.status_code == 200
+    assert time.monotonic() - start >= 0.9
+    assert not ac
+
+
+def test_retry_after_pauses_the_other_requests(ac):
+    ac.append((429, {'Retry-After': '1'}))
+    start = time.monotonic()
+    throttled = threading.Thread(target=ac_client.get_response, args=('contacts',))
+    throttled.start()
+    # wait until the first request got its 429
+    while ac:
+        time.sleep(0.01)
+    time.sleep(0.1)
+    ac_client.get_response('deals')
+    assert time.monotonic() - start >= 0.9
+    throttled.join(5)
@@ -0,0 +1,102 @@
+import threading
+import time
+
+import pytest
+
+from project.ac_limiter import BATCH, INTERACTIVE, RateLimiter
+from project.deadline import DeadlineExceeded, deadline
+
+
+def _acquire_in_thread(limiter, priority, order, label=None):
+    def acquire():
+        limiter.acquire(priority)
+        order.append(priority if label is None else label)
+    thread = threading.Thread(target=acquire)
+    thread.start()
+    return thread
+
+
+def _wait_for(limiter, count):
+    """waits until count threads queue for a token"""
+    while len(limiter._waiting) < count:
+        time.sleep(0.001)
+
+
+def test_interactive_requests_go_before_waiting_batch_requests():
+    limiter = RateLimiter(rate=10, burst=1)
+    limiter.acquire()
+    order = []
+    threads = [_acquire_in_thread(limiter, BATCH, order)]
+    _wait_for(limiter, 1)
+    threads.append(_acquire_in_thread(limiter, INTERACTIVE, order))
+    for thread in threads:
+        thread.join(2)
+    assert order == [INTERACTIVE, BATCH]
+
+
+def test_requests_of_the_same_priority_go_in_arrival_order():
+    limiter = RateLimiter(rate=20, burst=1)
+    limiter.acquire()
+    order = []
+    threads = []
+    for number in range(3):
+        threads.append(_acquire_in_thread(limiter, BATCH, order, number))
+        _wait_for(limiter, number + 1)
+    for thread in threads:
+        thread.join(2)
+    assert order == [0, 1, 2]
+
+
+def test_pause_holds_back_requests_despite_tokens():
+    limiter = RateLimiter(rate=100, burst=5)
+    limiter.pause(0.3)
+    start = time.monotonic()
+    limiter.acquire()
+    assert time.monotonic() - start >= 0.25
+
+
+def test_pause_beyond_the_deadline_fails_right_away():
+    limiter = RateLimiter(rate=100, burst=5)
+    limiter.pause(10)
+    start = time.monotonic()
+    with deadline(1), pytest.raises(DeadlineExceeded):
+        limiter.acquire()
+    assert time.monotonic() - start < 0.5
+
+
+def test_shared_bucket_is_used_up_by_all_limiters(tmp_path):
+    path = str(tmp_path / 'rate.sqlite')
+    first, second = RateLimiter(10, 2), RateLimiter(10, 2)
+    first.configure(10, 2, path=path)
+    second.configure(10, 2, path=path)
+    first.acquire()
+    first.acquire()
+    start = time.monotonic()
+    second.acquire()
+    assert time.monotonic() - start >= 0.05
+
+
+def test_shared_bucket_keeps_the_reserve_for_interactive_requests(tmp_path):
+    path = str(tmp_path / 'rate.sqlite')
+    limiter = RateLimiter(10, 3)
+    limiter.configure(10, 3, path=path, reserve=2)
+    # a batch request may only take the tokens above the reserve
+    limiter.acquire(BATCH)
+    start = time.monotonic()
+    limiter.acquire(INTERACTIVE)
+    limiter.acquire(INTERACTIVE)
+    assert time.monotonic() - start < 0.05
+    start = time.monotonic()
+    limiter.acquire(BATCH)
+    assert time.monotonic() - start >= 0.25
+
+
+def test_pause_of_a_shared_bucket_holds_back_all_limiters(tmp_path):
+    path = str(tmp_path / 'rate.sqlite')
+    first, second = RateLimiter(100, 5), RateLimiter(100, 5)
+    first.configure(100, 5, path=path)
+    second.configure(100, 5, path=path)
+    first.pause(0.3)
+    start = time.monotonic()
+    second.acquire()
+    assert time.monotonic() - start >= 0.25
@@ -0,0 +1,72 @@
+import time
+
+import pytest
+
+from config import Config
+from project import jobs
+
+
+@pytest.fixture(autouse=True)
+def queue(monkeypatch, tmp_path):
+    """an empty queue for every test"""
+    monkeypatch.setattr(Config, 'JOBS_DB', str(tmp_path / 'jobs.sqlite'))
+    monkeypatch.setattr(Config, 'JOBS_MAX_ATTEMPTS', 2)
+
+
+def _job(id):
+    return jobs._db().execute("SELECT * FROM jobs WHERE id = ?", (id,)).fetchone()
+
+
+def _expire_lease(id):
+    jobs._db().execute("UPDATE jobs SET locked_at = ? WHERE id = ?",
+                       (time.time() - Config.JOBS_LEASE - 1, id))
+
+
+def test_expired_lease_counts_as_failed_attempt():
+    jobs.enqueue('test.noop', {})
+    job = jobs._claim()
+    _expire_lease(job["id"])
+
+    # the retry is scheduled with a backoff, nothing is due yet
+    assert jobs._claim() is None
+    job = _job(job["id"])
+    assert job["status"] == 'queued'
+    assert job["attempts"] == 1
+    assert job["run_after"] > time.time()
+    assert 'lease expired' in job["last_error"]
+
+
+def test_job_losing_its_lease_repeatedly_is_given_up():
+    jobs.enqueue('test.noop', {})
+    for _ in range(Config.JOBS_MAX_ATTEMPTS):
+        job = jobs._claim()
+        _expire_lease(job["id"])
+        assert jobs._claim() is None
+        # skip the backoff
+        jobs._db().execute("UPDATE jobs SET run_after = 0")
+    job = _job(job["id"])
+    assert job["status"] == 'failed'
+    assert job["attempts"] == Config.JOBS_MAX_ATTEMPTS
+
+
+def test_running_job_within_its_lease_is_left_alone():
+    jobs.enqueue('test.noop', {})
+    job = jobs._claim()
+    assert jobs._claim() is None
+    assert _job(job["id"])["status"] == 'running'
+    assert _job(job["id"])["attempts"] == 0
+
+
+def test_done_jobs_are_purged_after_the_retention():
+    calls = []
+    jobs.handler('test.record')(calls.append)
+    jobs.enqueue('test.record', {'order': 1}, key='evt_1')
+    assert jobs.work_one()
+    assert calls == [{'order': 1}]
+
+    assert jobs.purge() == 0
+    jobs._db().execute("UPDATE jobs SET locked_at = ?",
+                       (time.time() - Config.JOBS_RETENTION - 1,))
+    assert jobs.purge() == 1
+    # the key is free again once the job is gone
+    assert jobs.enqueue('test.record', {'order': 1}, key='evt_1')
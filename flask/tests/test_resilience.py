@@ -0,0 +1,63 @@
+import time
+
+import pytest
+
+from project.resilience import CircuitBreaker, CircuitOpen
+
+
+def _open(breaker):
+    for _ in range(breaker.threshold):
+        breaker.allow()
+        breaker.record(False)
+
+
+def test_breaker_opens_after_threshold_failures_in_a_row():
+    breaker = CircuitBreaker('ac', threshold=3, reset_timeout=30)
+    breaker.allow()
+    breaker.record(False)
+    breaker.allow()
+    breaker.record(True)
+    _open(breaker)
+    with pytest.raises(CircuitOpen):
+        breaker.allow()
+
+
+def test_half_open_breaker_lets_one_trial_call_through():
+    breaker = CircuitBreaker('ac', threshold=2, reset_timeout=0.1)
+    _open(breaker)
+    time.sleep(0.15)
+    breaker.allow()
+    with pytest.raises(CircuitOpen):
+        breaker.allow()
+
+
+def test_successful_trial_closes_the_breaker():
+    breaker = CircuitBreaker('ac', threshold=2, reset_timeout=0.1)
+    _open(breaker)
+    time.sleep(0.15)
+    breaker.allow()
+    breaker.record(True)
+    breaker.allow()
+    breaker.allow()
+
+
+def test_failed_trial_keeps_the_breaker_open_for_another_reset_timeout():
+    breaker = CircuitBreaker('ac', threshold=2, reset_timeout=0.1)
+    _open(breaker)
+    time.sleep(0.15)
+    breaker.allow()
+    breaker.record(False)
+    with pytest.raises(CircuitOpen):
+        breaker.allow()
+    time.sleep(0.15)
+    breaker.allow()
+
+
+def test_trial_without_outcome_lets_the_next_call_try_again():
+    # e.g. the deadline of the trial call ran out
+    breaker = CircuitBreaker('ac', threshold=2, reset_timeout=0.1)
+    _open(breaker)
+    time.sleep(0.15)
+    breaker.allow()
+    breaker.record(None)
+    breaker.allow()
@@ -1,2 +1,3 @@
-from project import app
-from project import cli
\ No newline at end of file
+from project import create_app
+
+app = create_app()